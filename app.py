@@ -1,16 +1,31 @@
 import os
 import time
 import warnings
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
+from multiprocessing import get_context
 
 import tyro
-import whisper
-from deep_translator import BaiduTranslator, GoogleTranslator, constants
+from deep_translator import constants
 from rich.console import Console
 from rich.progress import Progress
 
-from srt_assembler import SrtAssembler
-from utils import LOGGER, ensure_folder_exists, extract_sound_from_video
+from asr_backend import load_backend
+from audio_cache import AudioCache
+from batch_packer import BatchPacker, translate_unique
+from pipeline import Pipeline, Stage
+from source_hashes import clip_source_text, edited_clips, load_source_hashes, load_subtitles, save_source_hashes
+from stream_translator import StreamTranslator
+from transcriber import Transcriber, load_window, resegment
+from translation_executor import TranslationExecutor
+from translation_memory import TranslationMemory
+from translators import load_translator, payload_limit, translator_name
+from utils import (LOGGER, ensure_folder_exists, extract_pcm_from_video,
+                   extract_sound_from_video, get_audio_duration, load_audio)
+from whisper_daemon import load_model
+from word_cache import WordCache
 from src.ass_container import SCRIPT_INFO, STYLES
 
 warnings.filterwarnings('ignore')
@@ -34,6 +49,8 @@ class TaskConfig:
     subtitle_type: str = '.ass'
     # 模型：tiny | base | small | medium | large | downloaded_model_path
     whisper_model: str = 'medium' 
+    # 语音识别后端 whisper: PyTorch推理 | ctranslate2: faster-whisper的int8量化推理，纯CPU时更快(需安装faster-whisper)
+    asr_backend: str = 'whisper'
     # 只有最后224个token会被使用。'Hello, welcome to my lecture.'可以减少无标点符号的情况。之后的部分建议写一些可能很难识别的专用名词。此外，每一句话的前一句也会通过该脚本添加到prompt中。因此，这里的prompt长度建议不超过120个单词。
     # whisper_prompt: str = "Hello, welcome to my lecture. Game dev about splines, bezier curve, De Casteljau's algorithm jerk."
     # whisper_prompt: str = 'こんにちは、私の講義へようこそ。'
@@ -41,33 +58,122 @@ class TaskConfig:
 
     # 用逗号断句的句子长度阈值
     comma_as_end_threshold: int = 70
+    # 单条字幕的最长时长(秒)。Whisper漏掉标点时在停顿最长处强制断句。0表示不限制
+    max_cue_duration: float = 15.
+    # 单条字幕的最大字符数，超出时同样强制断句。0表示不限制
+    max_line_length: int = 160
+    # 期望的每秒字符数上限，只是偏好: 强制断句时优先选不超过它的位置，按标点结束的字幕不受影响。0表示不考虑
+    preferred_cps: float = 25.
+    # 丢弃Whisper的幻觉输出(短语循环、连续低置信度单词、压缩比过高的片段)
+    filter_hallucination: bool = True
+    # 1~4个词的短语连续重复多少次视为循环
+    repeat_threshold: int = 4
+    # 片段文本的压缩比超过该值时整段丢弃
+    compression_ratio_threshold: float = 2.4
+    # 连续low_probability_run个单词的概率都低于low_probability时丢弃
+    low_probability: float = 0.1
+    low_probability_run: int = 6
+    # 解码前去掉长静音，只把语音部分拼接起来交给模型，单词时间再映射回原音频
+    compact_speech: bool = True
+    # 至少持续多少秒的静音才去掉
+    min_silence_seconds: float = 2.
+    # 比音频中较响的部分低多少dB视为静音
+    silence_threshold_db: float = 35.
+    # 切分长音频的策略 silence: 在静音处切分，每段只解码一次 | sentence: 从上一窗口最后一句的结尾重新开始
+    chunk_strategy: str = 'silence'
+    # 每个解码窗口的目标长度(秒)
+    chunk_seconds: int = 300
+    # sentence策略下窗口没有任何输出时，缩短到多少秒重试一次
+    min_chunk_seconds: int = 30
+    # silence策略下，在目标长度前后多少秒内寻找静音，必须小于chunk_seconds
+    chunk_search_seconds: int = 30
     # 调用翻译api每次发送的字符上限, 建议英文4500，日文1600。否则可能会报API server error.
     api_character_limit = 4200
     # 只进行翻译(使用srt_dir中的.srt文件)                                                                                
     only_translate: bool = False
+    # 从视频直接解码出16kHz单声道wav，跳过mp3转码和之后的二次解码。关闭时提取为mp3
+    fast_extract: bool = True
     # 语音转文字+翻译(使用audio_dir中的.mp3, .wav, .m4a文件)
     input_is_audio: bool = True
     # 翻译后只保留中文字幕
     only_zh: bool = False
     # 任务类型 transcribe | translate
     task: str = 'transcribe'
-    # 使用百度api
+    # 翻译后端 google | baidu | local | local-line: 本地翻译替身服务(local_translate_server.py)，用于不联网测试，local-line逐行发送
+    translator: str = 'google'
+    # local后端的服务地址
+    translator_url: str = 'http://127.0.0.1:8765'
+    # 使用百度api，等同于translator为baidu
     use_baidu_api: bool = False
     baidu_appid: str = ''
     baidu_appkey: str = ''
-    # 翻译源语言
+    # 翻译源语言，使用翻译api的语言代码
     src_lang: str = 'en'
+    # Whisper的识别语言，如ja。auto表示由Whisper在每个文件开头检测一次。
+    # 为空时task为transcribe则由src_lang推出(百度的jp、kor等会转换)，task为translate则检测
+    whisper_lang: str = ''
     # 翻译目标语言
     tgt_lang: str = 'zh'
+    # 边转文本边翻译。每结束一句字幕就送入后台翻译线程，转文本完成后几秒内即可写出双语字幕
+    stream_translate: bool = False
+    # 同时翻译为多个目标语言，用逗号分隔，如zh,ja,es。指定时忽略tgt_lang，输出文件名中带语言代码
+    tgt_langs: str = ''
+    # 同时发出的翻译请求数
+    translate_workers: int = 4
+    # 每个翻译后端每秒最多发出的请求数，以及允许的突发请求数
+    requests_per_second: float = 2.
+    request_burst: int = 4
+    # 翻译请求失败时的最大重试次数，重试间隔按指数增长并加入随机抖动
+    max_retries: int = 5
+    # 翻译过的句子存入翻译记忆(cache_dir下的SQLite数据库)，相同的句子不再调用翻译api
+    use_translation_memory: bool = True
     # 打印国家对应的缩写码
     print_country_code: bool = False
+    # whisper_daemon.py在运行时，通过它转文本，不在本进程加载模型
+    use_daemon: bool = True
+    # 转文本服务的Unix socket路径
+    daemon_socket: str = 'assets/cache/whisper.sock'
+    # 缓存目录。保存Whisper的单词级结果等
+    cache_dir: str = 'assets/cache/'
+    # 缓存每个窗口的单词级结果，相同音频和参数不再重复转文本
+    use_word_cache: bool = True
+    # 缓存解码后的音频，用memmap读取，命令行和字幕编辑器共用
+    use_audio_cache: bool = True
+    # 音频缓存的大小上限(GB)，超出时删除最久没用的文件
+    audio_cache_max_gb: float = 10.
+    # 只用缓存的单词重新断句生成.srt(修改comma_as_end_threshold等参数后使用)，不运行Whisper。
+    # 已有的双语字幕不会更新，需要删除后重新翻译
+    only_resegment: bool = False
+    # 只重新翻译校对后改动过原文的字幕(video_dir中已有的双语字幕)，其余字幕的译文保持不变
+    only_retranslate: bool = False
+    # 并行转文本的进程数。每个进程各自加载一份模型，torch线程数在进程间平分。1表示单进程
+    workers: int = 1
+    # 单个长文件切成以静音分隔的区域，由workers个进程同时转文本后拼接。适合少量长视频
+    split_file: bool = False
+    # split_file时每个区域向两侧多解码的秒数，避免切断边界处的单词
+    region_padding: float = 1.0
+    # 流水线模式：每个文件提取音频后立即转文本，转完立即翻译，三个阶段同时进行
+    pipeline: bool = False
+    # 流水线模式下音频提取的并发数
+    extract_concurrency: int = 2
+    # 流水线模式下翻译的并发数。转文本的并发数由workers决定
+    translate_concurrency: int = 2
+    # 流水线阶段间队列的容量
+    pipeline_queue_size: int = 2
 
 
 class GenerateSrtTask(object):
     def __init__(self, config: TaskConfig) -> None:
         self.config = config
+        # 翻译后端名称不合法时在开始转文本之前就报错
+        translator_name(config)
         self.model = None
         self.progress = Progress(transient=True)
+        # 多线程/多进程运行时关闭rich的动态显示，它们同一时间只能有一个
+        self.quiet = False
+        self.word_cache = WordCache(config.cache_dir) if config.use_word_cache else None
+        self.audio_cache = AudioCache(config.cache_dir, int(config.audio_cache_max_gb * 1024**3), SAMPLE_RATE) if config.use_audio_cache else None
+        self.memory = TranslationMemory(config.cache_dir) if config.use_translation_memory else None
 
         self._video_names = list(filter(lambda s: s.endswith(('mp4', 'mkv')), os.listdir(config.video_dir)))
         if self.config.input_is_audio:
@@ -76,6 +182,22 @@ class GenerateSrtTask(object):
             self._video_names = list(filter(lambda s: s.endswith('srt'), os.listdir(config.srt_dir)))
     
     def execute(self):
+        if self.config.only_resegment:
+            CONSOLE.rule('重新断句')
+            for v in self._video_names:
+                self.resegment_srt(v)
+            return
+
+        if self.config.only_retranslate:
+            CONSOLE.rule('重新翻译改动的字幕')
+            for v in self._video_names:
+                self.retranslate_edited(v)
+            return
+
+        if self.config.pipeline and not self.config.only_translate:
+            self.execute_pipeline()
+            return
+
         if (not self.config.only_translate) and (not self.config.input_is_audio): 
             CONSOLE.rule('提取音频')
             for v in self._video_names:
@@ -83,184 +205,436 @@ class GenerateSrtTask(object):
         
         if not self.config.only_translate:
             CONSOLE.rule('音频转文字')
-            for v in self._video_names:
-                self.speech_to_text(v)
+            if self.config.workers > 1 and self.config.split_file:
+                with self.create_worker_pool(self.config.workers) as pool:
+                    for v in self._video_names:
+                        self.speech_to_text(v, pool)
+            elif self.config.workers > 1:
+                self.batch_speech_to_text()
+            else:
+                for v in self._video_names:
+                    self.speech_to_text(v)
         
         CONSOLE.rule('字幕翻译')
         
         for v in self._video_names:
             self.translate_srt(v)
 
+    def execute_pipeline(self):
+        """提取 -> 转文本 -> 翻译 流水线。文件完成一个阶段就进入下一阶段，
+        翻译请求和ffmpeg解码与Whisper计算重叠进行
+        """
+        CONSOLE.rule('流水线: 提取音频 -> 音频转文字 -> 字幕翻译')
+        self.quiet = True
+        self.progress = Progress(disable=True)
+
+        pool = None
+        if self.config.workers > 1:
+            pool = self.create_worker_pool(self.config.workers)
+
+        def extract(v):
+            if not self.config.input_is_audio:
+                self.extract_audio_from_video(v)
+            return v
+
+        def transcribe(v):
+            if pool is not None:
+                pool.submit(_worker_speech_to_text, v).result()
+            else:
+                self.speech_to_text(v)
+            return v
+
+        def translate(v):
+            self.translate_srt(v)
+            return v
+
+        pipeline = Pipeline([
+            Stage('提取音频', extract, self.config.extract_concurrency),
+            Stage('音频转文字', transcribe, self.config.workers),
+            Stage('字幕翻译', translate, self.config.translate_concurrency),
+        ], queue_size=self.config.pipeline_queue_size)
+
+        try:
+            pipeline.run(self._video_names)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def status(self, msg, **kwargs):
+        if self.quiet:
+            return nullcontext()
+        return CONSOLE.status(msg, **kwargs)
+
     def extract_audio_from_video(self, basename: str):
         filename, suffix = os.path.splitext(basename)
         video_path = self.config.video_dir + basename
-        audio_path = self.config.audio_dir + filename + '.mp3'
+        audio_path = self.get_audio_path(basename)
 
         if os.path.exists(audio_path):
             LOGGER.info(audio_path + ' 已存在')
             return
         
-        with CONSOLE.status(filename + ' 提取中'):
-            extract_sound_from_video(video_path, audio_path, format='mp3')
+        with self.status(filename + ' 提取中'):
+            if self.config.fast_extract:
+                extract_pcm_from_video(video_path, audio_path, SAMPLE_RATE)
+            else:
+                extract_sound_from_video(video_path, audio_path, format='mp3')
         LOGGER.info(filename + ' 提取完成')
 
-    def speech_to_text(self, basename):
+    def get_audio_path(self, basename):
         filename, suffix = os.path.splitext(basename)
-        
         if self.config.input_is_audio:
-            audio_path = self.config.audio_dir + basename
-        else:
-            audio_path = self.config.audio_dir + filename + '.mp3'
+            return self.config.audio_dir + basename
+        return self.config.audio_dir + filename + ('.wav' if self.config.fast_extract else '.mp3')
+
+    def batch_speech_to_text(self):
+        """多进程转文本。按音频时长从长到短派发，避免最长的文件最后才开始"""
+        pending = []
+        for v in self._video_names:
+            srt_path = self.config.srt_dir + os.path.splitext(v)[0] + '.srt'
+            if os.path.exists(srt_path):
+                LOGGER.info(srt_path + ' 已存在')
+                continue
+            pending.append((get_audio_duration(self.get_audio_path(v)), v))
+        if not pending:
+            return
+        pending.sort(reverse=True)
+
+        total_audio_seconds = 0.
+        start_time = time.time()
+        with self.create_worker_pool(min(self.config.workers, len(pending))) as pool:
+            futures = {pool.submit(_worker_speech_to_text, v): v for _, v in pending}
+            for future in as_completed(futures):
+                try:
+                    total_audio_seconds += future.result()
+                except Exception as e:
+                    LOGGER.error(f'{futures[future]} 转文本出错: {e}')
+        elapsed = time.time() - start_time
+
+        if total_audio_seconds > 0:
+            LOGGER.info(f'音频总长 {total_audio_seconds:.1f}s，耗时 {elapsed:.1f}s，RTF: {elapsed / total_audio_seconds:.3f}')
+
+    def create_worker_pool(self, workers):
+        """创建转文本进程池，每个进程各自加载模型，并平分torch线程"""
+        num_threads = max(1, (os.cpu_count() or 1) // workers)
+        LOGGER.info(f'{workers}个进程并行转文本，每个进程{num_threads}个线程')
+        # torch与fork不兼容，子进程统一用spawn启动
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.config, num_threads)
+        )
+
+    def speech_to_text(self, basename, pool=None):
+        """返回实际转写的音频时长(秒)。已存在或失败时返回0
+
+        pool: 提供时把文件切成多个区域，在进程池中并行转文本
+        """
+        filename, suffix = os.path.splitext(basename)
+        
+        audio_path = self.get_audio_path(basename)
         srt_path = self.config.srt_dir + filename + '.srt'
 
         if os.path.exists(srt_path):
             LOGGER.info(srt_path + ' 已存在')
-            return
+            return 0.
         
-        if not self.model:
-            with CONSOLE.status('模型加载中...'):
-                self.model = whisper.load_model(self.config.whisper_model)
+        if not self.model and pool is None:
+            with self.status('模型加载中...'):
+                self.model = load_model(self.config.whisper_model, self.config.daemon_socket, self.config.use_daemon, self.config.asr_backend)
         
         whisper_task = self.progress.add_task(f'[green]{filename} 转文本中...\n', total=100)
         self.progress.start()
 
         # 将音频读取为numpy
-        audio_np = whisper.audio.load_audio(audio_path)
-
-        # 选取长5分钟的片段
-        segment_length = 5 * 60 * SAMPLE_RATE
-        clip_start = 0
-        clip_end = clip_start + segment_length
-        clip_last_sentence = ''
-
-        # 逐片段转文本
-        sa = SrtAssembler(self.config.comma_as_end_threshold)
-        while clip_end < audio_np.size:
-            result = self.model.transcribe(audio_np[clip_start:clip_end], word_timestamps=True, initial_prompt=self.config.whisper_prompt + ' ' + filename + '.', task=self.config.task)
-                
-            for segment in result['segments']:
-                for word_dict in segment['words']:
-                    sa.get_next_input(word_dict, clip_start / SAMPLE_RATE)
-            
-            new_clip_start, clip_last_sentence = sa.get_clip_end_info(SAMPLE_RATE)
-            if new_clip_start == clip_start:
-                # 输出没有标点导致的
-                LOGGER.warn(f"{filename} with {segment_length/SAMPLE_RATE} sucks.")
-                LOGGER.debug(clip_last_sentence)
-                sa.line_text = ""                
-                LOGGER.error("转文本失败，跳过")
-                return
-                # segment_length = segment_length + int(SAMPLE_RATE * random() * 60)
-            clip_start = new_clip_start
-            clip_end = clip_start + segment_length
-            self.progress.update(whisper_task, completed=clip_start/audio_np.size*100)
+        if self.audio_cache is not None:
+            audio_np = self.audio_cache.load(audio_path)
         else:
-            result = self.model.transcribe(audio_np[clip_start:], word_timestamps=True, initial_prompt=self.config.whisper_prompt + ' ' + clip_last_sentence, task=self.config.task)
-
-            for segment in result['segments']:
-                for word_dict in segment['words']:
-                    sa.get_next_input(word_dict, clip_start / SAMPLE_RATE)
-            
-            self.progress.update(whisper_task, completed=100)
+            audio_np = load_audio(audio_path, SAMPLE_RATE)
+
+        streams = self.start_stream_translation(filename) if self.config.stream_translate else {}
+        on_line = (lambda cue: [stream.put(cue) for stream in streams.values()]) if streams else None
+        transcriber = Transcriber(self.model, self.config, lambda p: self.progress.update(whisper_task, completed=p*100), self.word_cache, on_line)
+        map_windows = None
+        if pool is not None:
+            map_windows = lambda windows, prompts, languages: bounded_map(
+                pool, _worker_transcribe_window, windows, prompts, languages, limit=self.config.workers * 2
+            )
+        try:
+            sa = transcriber.transcribe(audio_np, filename, title=filename + '.', map_windows=map_windows,
+                                        checkpoint_path=srt_path + '.ckpt', stream_path=srt_path)
+        except BaseException:
+            # 停掉后台翻译线程
+            for stream in streams.values():
+                stream.finish(0)
+            raise
+        finally:
             self.progress.stop()
 
         LOGGER.info(filename + ' 转换完成')
 
         sa.generate_srt(srt_path)
+        transcriber.finish()
+        if streams:
+            self.finish_stream_translation(filename, srt_path, streams)
+        return audio_np.size / SAMPLE_RATE
+
+    def start_stream_translation(self, filename):
+        """为还没有双语字幕的每个目标语言启动一个后台翻译线程"""
+        streams = {}
+        for tgt_lang in self.target_langs():
+            if os.path.exists(self.bilingual_path(filename, tgt_lang)):
+                continue
+            executor = self.new_executor(tgt_lang)
+            streams[tgt_lang] = StreamTranslator(
+                lambda lines, executor=executor: self.translate_lines(executor, lines),
+                self.config.api_character_limit, f'{filename} ({tgt_lang})'
+            )
+        return streams
+
+    def finish_stream_translation(self, filename, srt_path, streams):
+        """等待剩下的句子翻译完，写入双语字幕。失败的语言留给translate_srt重新翻译"""
+        with open(srt_path, 'r', encoding='utf-8') as f:
+            text_lines = f.readlines()
+        subtitles = [text_lines[i].strip() for i in range(2, len(text_lines) - 1, 4)]
+
+        for tgt_lang, stream in streams.items():
+            translated_subtitles = stream.finish(len(subtitles))
+            if translated_subtitles is None:
+                LOGGER.warn(f'{filename} ({tgt_lang}) 边转文本边翻译未完成，稍后重新翻译')
+                continue
+            self.translate_to(filename, text_lines, subtitles, tgt_lang, translated_subtitles)
+            LOGGER.info(f'{self.bilingual_path(filename, tgt_lang)} 已随转文本一起翻译完成')
+
+    def resegment_srt(self, basename):
+        """用缓存的单词级结果重新生成.srt"""
+        filename, suffix = os.path.splitext(basename)
+        srt_path = self.config.srt_dir + filename + '.srt'
+
+        if self.word_cache is None:
+            LOGGER.error('重新断句需要开启use_word_cache')
+            return
+        start_time = time.time()
+        regions = self.word_cache.load_regions(filename)
+        if regions is None:
+            LOGGER.error(f'{filename} 没有可用的缓存，需要重新转文本')
+            return
+
+        sa = resegment(regions, self.config, self.word_cache.load_speech_spans(filename))
+        sa.generate_srt(srt_path)
+        LOGGER.info(f'{srt_path} 重新断句完成，{sa.line_count}句(强制切分{sa.forced_splits}次)，耗时 {(time.time() - start_time) * 1000:.0f}ms')
+
+        # 双语字幕按旧的断句生成，不会自动更新。校对过的双语字幕可能有手工修改，这里不删除
+        stale = [self.bilingual_path(filename, lang) for lang in self.target_langs()]
+        stale = [path for path in stale if os.path.exists(path)]
+        if stale:
+            LOGGER.warn(
+                f'{filename} 的双语字幕仍是按旧的断句生成的，需要删除后重新翻译(翻译记忆中已有的句子不会再请求api): '
+                + ', '.join(stale)
+            )
+
+    def target_langs(self):
+        if self.config.tgt_langs:
+            return [lang.strip() for lang in self.config.tgt_langs.split(',') if lang.strip()]
+        return [self.config.tgt_lang]
+
+    def bilingual_path(self, filename, tgt_lang):
+        """指定多个目标语言时，文件名中加上语言代码"""
+        if self.config.tgt_langs:
+            return f'{self.config.video_dir}{filename}.{tgt_lang}{self.config.subtitle_type}'
+        return self.config.video_dir + filename + self.config.subtitle_type
 
     def translate_srt(self, basename):
+        """字幕只读取一次，同时翻译为所有目标语言"""
         filename, suffix = os.path.splitext(basename)
 
         srt_path = self.config.srt_dir + filename + '.srt'
-        bilingual_srt_path = self.config.video_dir + filename + self.config.subtitle_type
 
-        if os.path.exists(bilingual_srt_path):
-            LOGGER.info(bilingual_srt_path + ' 已存在')
+        tgt_langs = []
+        for tgt_lang in self.target_langs():
+            bilingual_srt_path = self.bilingual_path(filename, tgt_lang)
+            if os.path.exists(bilingual_srt_path):
+                LOGGER.info(bilingual_srt_path + ' 已存在')
+            else:
+                tgt_langs.append(tgt_lang)
+        if not tgt_langs:
             return
         
         if not os.path.exists(srt_path):
             LOGGER.error('待翻译文本不存在')
             return
         
-        with CONSOLE.status(filename + ' 翻译中', spinner='earth'):
-            if self.config.use_baidu_api:
-                translator = BaiduTranslator(
-                    source=self.config.src_lang, target=self.config.tgt_lang, 
-                    appid=self.config.baidu_appid, appkey=self.config.baidu_appkey
-                )
-            else:
-                if self.config.tgt_lang == 'zh':
-                    self.config.tgt_lang = 'zh-CN'
-                # 有最多5000字符限制
-                translator = GoogleTranslator(source=self.config.src_lang, target=self.config.tgt_lang)
-
-            subtitles = []
-            translated_subtitles = []
-            total_chara = 0
-            # last_len = 0
+        with self.status(filename + ' 翻译中', spinner='earth'):
             with open(srt_path, 'r', encoding='utf-8') as f:
                 text_lines = f.readlines()
-                
-                for i in range(2, len(text_lines) - 1, 4):
-                    subtitle = text_lines[i]
-                    total_chara += len(subtitle)
-                    subtitles.append(subtitle)
-                    # 打包翻译，减少API调用次数
-                    if total_chara > self.config.api_character_limit:
-                        translation = translator.translate(''.join(subtitles))
-                        translation_lst = translation.split('\n')
-                        # 打包翻译有时会导致行数不匹配，此时尝试用更少的行数打包翻译。
-                        if len(translation_lst) != len(subtitles):
-                            translation_lst.clear()
-                            for i in range(0, len(subtitles), 10):
-                                translation = translator.translate(''.join(subtitles[i:i+10]))
-                                time.sleep(0.01)
-                                translation_lst.extend(translation.split('\n'))
-                            LOGGER.debug(len(translation_lst) != len(subtitles))
-                        translated_subtitles.extend(translation_lst)
-                        subtitles = []
-                        total_chara = 0
-                        time.sleep(.1) # 等待0.2秒
-
-                translation = translator.translate(''.join(subtitles))
-                translated_subtitles.extend(translation.split('\n'))
-
-            if self.config.subtitle_type == '.srt':
-                for i in range(2, len(text_lines) - 1, 4):
-                    if self.config.only_zh:
-                        text_lines[i] = translated_subtitles[(i - 2) // 4] + '\n' # 单独中文字幕
-                    else:
-                        text_lines[i] = translated_subtitles[(i - 2) // 4] + '\n' + text_lines[i] # 中英混合
-
-                with open(bilingual_srt_path, 'w', encoding='utf-8') as f:
-                    f.write(''.join(text_lines))
-
-            elif self.config.subtitle_type == '.ass':
-                with open(bilingual_srt_path, 'w', encoding='utf-8') as f:
-                    f.write(
-                        SCRIPT_INFO + '\n\n' 
-                        + STYLES + '\n\n' 
-                        + '[Events]\n' 
-                        + 'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n'
-                    )
-
-                    srt_text = ""
-                    for i in range(0, len(text_lines) - 1, 4):
-                        srt_text += f"Dialogue: "
-                        clip_start, clip_end = text_lines[i+1].split('-->')
-                        clip_start = clip_start.strip().replace(',', '.')[:-1]
-                        clip_end = clip_end.strip().replace(',', '.')[:-1]
-                        srt_text += f"0,{clip_start},{clip_end},ZH,"
-                        srt_text += f",0,0,0,"
-                        if self.config.only_zh:
-                            srt_text += f",{translated_subtitles[i // 4]}"
-                        else:
-                            srt_text += f",{translated_subtitles[i // 4]}\\N" + "{\\rEN}" + f"{text_lines[i+2].strip()}\n"
-                    f.write(srt_text)
+            subtitles = [text_lines[i].strip() for i in range(2, len(text_lines) - 1, 4)]
+
+            if len(tgt_langs) == 1:
+                self.translate_to(filename, text_lines, subtitles, tgt_langs[0])
             else:
-                LOGGER.error(f'只支持.srt|.ass两种类型的字幕文件。当前: {self.config.subtitle_type}')
+                # 各语言的请求共用同一个翻译后端的令牌桶
+                with ThreadPoolExecutor(len(tgt_langs)) as pool:
+                    list(pool.map(lambda tgt_lang: self.translate_to(filename, text_lines, subtitles, tgt_lang), tgt_langs))
 
         LOGGER.info(filename + ' 翻译完成')
+        if self.memory is not None:
+            self.memory.report()
+
+    def translate_to(self, filename, text_lines, subtitles, tgt_lang, translated_subtitles=None):
+        """把读取好的字幕翻译为tgt_lang，写入双语字幕
+
+        translated_subtitles: 已经有译文时(边转文本边翻译)直接写入
+        """
+        bilingual_srt_path = self.bilingual_path(filename, tgt_lang)
+        if translated_subtitles is None:
+            executor = self.new_executor(tgt_lang)
+            translated_subtitles = translate_unique(
+                subtitles, lambda lines: self.translate_lines(executor, lines),
+                self.config.api_character_limit, f'{filename} ({tgt_lang})'
+            )
+            LOGGER.debug(f'{filename} ({tgt_lang}) 翻译请求 {executor.requests} 次，重试 {executor.retries} 次')
+
+        if self.config.subtitle_type == '.srt':
+            text_lines = list(text_lines)
+            for i in range(2, len(text_lines) - 1, 4):
+                if self.config.only_zh:
+                    text_lines[i] = translated_subtitles[(i - 2) // 4] + '\n' # 单独中文字幕
+                else:
+                    text_lines[i] = translated_subtitles[(i - 2) // 4] + '\n' + text_lines[i] # 中英混合
+
+            with open(bilingual_srt_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(text_lines))
+
+        elif self.config.subtitle_type == '.ass':
+            with open(bilingual_srt_path, 'w', encoding='utf-8') as f:
+                f.write(
+                    SCRIPT_INFO + '\n\n' 
+                    + STYLES + '\n\n' 
+                    + '[Events]\n' 
+                    + 'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n'
+                )
+
+                srt_text = ""
+                for i in range(0, len(text_lines) - 1, 4):
+                    srt_text += f"Dialogue: "
+                    clip_start, clip_end = text_lines[i+1].split('-->')
+                    clip_start = clip_start.strip().replace(',', '.')[:-1]
+                    clip_end = clip_end.strip().replace(',', '.')[:-1]
+                    srt_text += f"0,{clip_start},{clip_end},ZH,"
+                    srt_text += f",0,0,0,"
+                    if self.config.only_zh:
+                        srt_text += f",{translated_subtitles[i // 4]}"
+                    else:
+                        srt_text += f",{translated_subtitles[i // 4]}\\N" + "{\\rEN}" + f"{text_lines[i+2].strip()}\n"
+                f.write(srt_text)
+        else:
+            LOGGER.error(f'只支持.srt|.ass两种类型的字幕文件。当前: {self.config.subtitle_type}')
+            return
+        save_source_hashes(bilingual_srt_path)
+
+    def retranslate_edited(self, basename):
+        """比较双语字幕中的原文和翻译时记录的哈希，只翻译改动过的字幕并写回原文件"""
+        filename, suffix = os.path.splitext(basename)
+        for tgt_lang in self.target_langs():
+            bilingual_srt_path = self.bilingual_path(filename, tgt_lang)
+            if not os.path.exists(bilingual_srt_path):
+                LOGGER.error(f'{bilingual_srt_path} 不存在')
+                continue
+
+            hashes = load_source_hashes(bilingual_srt_path)
+            if hashes is None:
+                LOGGER.error(f'{bilingual_srt_path} 没有原文哈希记录，需要先删除它并重新翻译一次')
+                continue
+
+            container = load_subtitles(bilingual_srt_path)
+            sources = [clip_source_text(clip) for clip in container.clips]
+            changed = edited_clips(container.clips, hashes)
+            if not changed:
+                LOGGER.info(f'{bilingual_srt_path} 没有改动过的字幕')
+                continue
+
+            executor = self.new_executor(tgt_lang)
+            translations = translate_unique(
+                [sources[i] for i in changed], lambda lines: self.translate_lines(executor, lines),
+                self.config.api_character_limit, filename
+            )
+            for i, translation in zip(changed, translations):
+                container.clips[i].source_text = translation
+
+            with open(bilingual_srt_path, 'w', encoding='utf-8') as f:
+                f.write(container.export_srt())
+            save_source_hashes(bilingual_srt_path, container.clips)
+            LOGGER.info(f'{bilingual_srt_path} 重新翻译 {len(changed)} / {len(sources)} 条字幕，翻译请求 {executor.requests} 次')
+
+    def new_translator(self, tgt_lang):
+        return load_translator(
+            translator_name(self.config), self.config.src_lang, tgt_lang,
+            appid=self.config.baidu_appid, appkey=self.config.baidu_appkey, url=self.config.translator_url
+        )
+
+    def new_executor(self, tgt_lang):
+        return TranslationExecutor(
+            lambda: self.new_translator(tgt_lang), translator_name(self.config),
+            self.config.translate_workers, self.config.requests_per_second, self.config.request_burst, self.config.max_retries,
+            target=tgt_lang
+        )
+
+    def translate_lines(self, executor: TranslationExecutor, subtitles):
+        """先查翻译记忆，剩下的行打包翻译"""
+        if self.memory is None:
+            return self.batch_translate(executor, subtitles)
+        return self.memory.translate(
+            executor.backend, self.config.src_lang, executor.target, subtitles,
+            lambda lines: self.batch_translate(executor, lines)
+        )
+
+    def batch_translate(self, executor: TranslationExecutor, subtitles):
+        """打包翻译，减少API调用次数。各个包并发发送，按顺序返回每一行的译文"""
+        packer = BatchPacker(payload_limit(executor.backend, self.config.api_character_limit))
+        translated_subtitles = packer.translate(subtitles, executor.translate, executor.map)
+        packer.report()
+        return translated_subtitles
+
+
+# 多进程转文本时，每个子进程持有一个GenerateSrtTask和一份模型
+_worker_task = None
+
+
+def _init_worker(config: TaskConfig, num_threads: int):
+    global _worker_task
+    import torch
+    torch.set_num_threads(num_threads)
+
+    _worker_task = GenerateSrtTask(config)
+    # 多个进程同时刷新进度条会让终端输出错乱
+    _worker_task.quiet = True
+    _worker_task.progress = Progress(disable=True)
+    _worker_task.model = load_backend(config.asr_backend, config.whisper_model, cpu_threads=num_threads)
+
+
+def _worker_speech_to_text(basename):
+    return _worker_task.speech_to_text(basename)
+
+
+def _worker_transcribe_window(window, prompt, language):
+    return Transcriber(_worker_task.model, _worker_task.config).transcribe_window(load_window(window), prompt, language)
+
+
+def bounded_map(pool, func, *iterables, limit=4):
+    """和pool.map一样按顺序返回结果，但同时最多提交limit个任务，参数按需从iterables中取出
+
+    pool.map会立刻序列化所有参数，音频不是memmap时，所有窗口的音频会同时在内存中多出一份
+    """
+    results = []
+    futures = deque()
+    for args in zip(*iterables):
+        if len(futures) >= limit:
+            results.append(futures.popleft().result())
+        futures.append(pool.submit(func, *args))
+    results.extend(future.result() for future in futures)
+    return results
+
 
 if __name__ == '__main__':
     args = tyro.cli(TaskConfig)
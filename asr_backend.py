@@ -0,0 +1,88 @@
+"""语音识别后端
+
+所有后端的transcribe返回与whisper相同结构的结果(见srt_assembler.py开头的说明)，
+Transcriber和SrtAssembler不需要关心具体用的是哪个引擎。
+
+    whisper: openai-whisper，PyTorch fp32推理
+    ctranslate2: faster-whisper，CTranslate2 int8量化推理，在纯CPU机器上明显更快
+"""
+from utils import LOGGER
+
+
+class AsrBackend(object):
+    name = ''
+
+    def transcribe(self, audio, word_timestamps=True, initial_prompt=None, task='transcribe', language=None, **kwargs):
+        raise NotImplementedError
+
+
+class WhisperBackend(AsrBackend):
+    name = 'whisper'
+
+    def __init__(self, model_name, **kwargs):
+        import whisper
+        self.model = whisper.load_model(model_name)
+
+    def transcribe(self, audio, word_timestamps=True, initial_prompt=None, task='transcribe', language=None, **kwargs):
+        return self.model.transcribe(
+            audio, word_timestamps=word_timestamps, initial_prompt=initial_prompt,
+            task=task, language=language, **kwargs
+        )
+
+
+class CTranslate2Backend(AsrBackend):
+    name = 'ctranslate2'
+
+    def __init__(self, model_name, compute_type='int8', cpu_threads=0, **kwargs):
+        try:
+            from faster_whisper import WhisperModel
+        except ImportError:
+            raise ImportError('ctranslate2后端需要安装faster-whisper: pip install faster-whisper')
+        self.model = WhisperModel(model_name, device='cpu', compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def transcribe(self, audio, word_timestamps=True, initial_prompt=None, task='transcribe', language=None, **kwargs):
+        segments, info = self.model.transcribe(
+            audio, word_timestamps=word_timestamps, initial_prompt=initial_prompt,
+            task=task, language=language, **kwargs
+        )
+        result_segments = []
+        for segment in segments:
+            result_segments.append({
+                'id': segment.id,
+                'seek': segment.seek,
+                'start': segment.start,
+                'end': segment.end,
+                'text': segment.text,
+                'tokens': list(segment.tokens),
+                'temperature': segment.temperature,
+                'avg_logprob': segment.avg_logprob,
+                'compression_ratio': segment.compression_ratio,
+                'no_speech_prob': segment.no_speech_prob,
+                'words': [
+                    {'word': w.word, 'start': w.start, 'end': w.end, 'probability': w.probability}
+                    for w in (segment.words or [])
+                ],
+            })
+        return {
+            'text': ''.join(s['text'] for s in result_segments),
+            'segments': result_segments,
+            'language': info.language,
+        }
+
+
+BACKENDS = {
+    WhisperBackend.name: WhisperBackend,
+    CTranslate2Backend.name: CTranslate2Backend,
+}
+
+
+def load_backend(backend, model_name, **kwargs):
+    if backend not in BACKENDS:
+        raise ValueError(f'不支持的语音识别后端 {backend}，可选: {" | ".join(BACKENDS)}')
+    LOGGER.debug(f'加载{backend}后端模型 {model_name}')
+    return BACKENDS[backend](model_name, **kwargs)
+
+
+def model_id(backend, model_name):
+    """缓存和断点中区分不同后端的结果"""
+    return model_name if backend == WhisperBackend.name else f'{backend}:{model_name}'
@@ -0,0 +1,78 @@
+import hashlib
+import os
+import time
+
+import numpy as np
+
+from utils import LOGGER, check_ffmpeg_exit, ensure_folder_exists, ffmpeg_pcm_stream
+
+
+def file_digest(path, block_size=1 << 20):
+    """文件内容的哈希。同一个文件改名或移动后仍然命中缓存"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+class AudioCache(object):
+    """解码后音频的磁盘缓存，命令行和字幕编辑器共用
+
+    以源文件内容的哈希为键，保存为float32的原始PCM文件，读取时用numpy.memmap映射，
+    切片audio_np[clip_start:clip_end]只会读入用到的部分，不再每次运行都用ffmpeg解码整个文件。
+    缓存总大小超过max_bytes时，删除最久没有使用的文件。
+    """
+    def __init__(self, cache_dir, max_bytes, sr=16000):
+        self.cache_dir = os.path.join(cache_dir, 'audio')
+        self.max_bytes = max_bytes
+        self.sr = sr
+        ensure_folder_exists(self.cache_dir)
+
+    def cache_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}_{self.sr}.f32')
+
+    def load(self, path):
+        key = file_digest(path)
+        cache_path = self.cache_path(key)
+        if os.path.exists(cache_path):
+            # 更新修改时间，作为LRU的使用时间
+            os.utime(cache_path)
+            LOGGER.debug(f'{os.path.basename(path)} 命中音频缓存')
+        else:
+            self.decode_to_raw(path, cache_path)
+            self.evict(keep=cache_path)
+        if os.path.getsize(cache_path) == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.memmap(cache_path, dtype=np.float32, mode='r')
+
+    def decode_to_raw(self, path, cache_path, chunk_size=1 << 20):
+        """ffmpeg流式解码，逐块追加写入，内存占用与文件长度无关"""
+        t0 = time.time()
+        tmp_path = cache_path + '.tmp'
+        process = ffmpeg_pcm_stream(path, self.sr)
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = process.stdout.read(chunk_size)
+                if not chunk:
+                    break
+                (np.frombuffer(chunk, dtype=np.int16) / np.float32(32768.0)).astype(np.float32).tofile(f)
+        check_ffmpeg_exit(process, path)
+        os.replace(tmp_path, cache_path)
+        LOGGER.info(f'{os.path.basename(path)} 解码并写入音频缓存，耗时 {time.time() - t0:.2f}s')
+
+    def evict(self, keep=None):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.f32')]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        for f in files:
+            if total <= self.max_bytes:
+                break
+            if f == keep:
+                continue
+            total -= os.path.getsize(f)
+            os.remove(f)
+            LOGGER.debug(f'音频缓存超出上限，删除 {f}')
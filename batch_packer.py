@@ -0,0 +1,159 @@
+"""带行号标记的打包翻译
+
+多行字幕用换行符拼在一起翻译时，翻译api经常合并或拆分行，按换行符切分后行数对不上，
+只能整包丢弃重新翻译。这里每行前加上[行号]标记，翻译后按标记找回每一行，
+只重新发送标记丢失的行。
+"""
+import re
+import threading
+
+from translation_memory import normalize_text
+from utils import LOGGER
+
+# 翻译成中日文时方括号可能被换成全角。只认行首的标记，原文中的"figure [7]"不会被当作标记
+MARKER_RE = re.compile(r'^\s*[\[【［]\s*(\d+)\s*[\]】］]', re.M)
+
+
+def encode_package(lines):
+    return '\n'.join(f'[{i}] {line}' for i, line in enumerate(lines, 1))
+
+
+def decode_package(translation, size):
+    """返回{行号(从0开始): 译文}
+
+    重复出现的标记所对应的行视为丢失。超出范围的标记说明上一行的译文被切开了，上一行也视为丢失，不截断它的译文
+    """
+    parts = MARKER_RE.split(translation)
+    found = {}
+    lost = set()
+    prev = None
+    # parts: [标记前的文本, 行号, 译文, 行号, 译文, ...]
+    for i in range(1, len(parts) - 1, 2):
+        index = int(parts[i]) - 1
+        if not 0 <= index < size:
+            if prev is not None:
+                lost.add(prev)
+            continue
+        if index in found:
+            lost.add(index)
+        found[index] = parts[i + 1].strip()
+        prev = index
+    for index in lost:
+        found.pop(index, None)
+    return found
+
+
+class BatchPacker(object):
+    """limit: 每个包的字符上限(含标记)。为0时不打包，逐行翻译"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.lock = threading.Lock()
+        self.packages = 0
+        self.packed_lines = 0
+        self.packed_characters = 0
+        self.resent_lines = 0
+        self.resend_requests = 0
+
+    def pack(self, lines):
+        """按顺序把行分成不超过limit个字符的包，返回[[行的下标, ...], ...]。空行不翻译"""
+        packages = []
+        package = []
+        total_chara = 0
+        for i, line in enumerate(lines):
+            if not line:
+                continue
+            size = len(line) + len(str(len(package) + 1)) + 4
+            if package and total_chara + size > self.limit:
+                packages.append(package)
+                package = []
+                total_chara = 0
+                size = len(line) + 5
+            package.append(i)
+            total_chara += size
+        if package:
+            packages.append(package)
+        return packages
+
+    def translate(self, lines, translate, map_func=None):
+        """按顺序返回每一行的译文
+
+        translate(text): 翻译一段文本
+        map_func(func, items): 按顺序返回func(item)的列表，可以传入并发的实现
+        """
+        map_func = map_func or (lambda func, items: [func(item) for item in items])
+        if self.limit <= 0:
+            return map_func(lambda line: translate(line).strip() if line else '', lines)
+
+        packages = self.pack(lines)
+        results = map_func(lambda package: self.translate_package([lines[i] for i in package], translate), packages)
+
+        translations = [''] * len(lines)
+        for package, package_translations in zip(packages, results):
+            for i, translation in zip(package, package_translations):
+                translations[i] = translation
+        return translations
+
+    def translate_package(self, lines, translate, resend=True):
+        text = encode_package(lines)
+        found = decode_package(translate(text), len(lines))
+        with self.lock:
+            self.packages += 1
+            self.packed_lines += len(lines)
+            self.packed_characters += len(text)
+
+        missing = [i for i in range(len(lines)) if i not in found]
+        # 标记丢失通常是这一行被合并到了上一行，上一行的译文也不可信
+        missing = sorted(set(missing) | {i - 1 for i in missing if i > 0})
+        if missing:
+            with self.lock:
+                self.resent_lines += len(missing)
+            if resend and len(missing) > 1:
+                # 丢失的行重新打一个包，仍然丢失的再逐行翻译
+                with self.lock:
+                    self.resend_requests += 1
+                retry = self.translate_package([lines[i] for i in missing], translate, resend=False)
+                found.update(zip(missing, retry))
+            else:
+                for i in missing:
+                    with self.lock:
+                        self.resend_requests += 1
+                    found[i] = translate(lines[i]).strip()
+        return [found[i] for i in range(len(lines))]
+
+    def report(self, name=''):
+        if self.packages == 0:
+            return
+        LOGGER.info(
+            f'{name} 翻译{self.packed_lines}行，共{self.packages}个包，平均每包{self.packed_lines / self.packages:.1f}行、'
+            f'填充率{self.packed_characters / (self.packages * self.limit):.1%}，'
+            f'重发{self.resent_lines}行({self.resend_requests}次请求)'
+        )
+
+
+def translate_unique(lines, translate_lines, limit, name=''):
+    """相同的行只翻译一次，译文再填回所有出现的位置
+
+    讲座视频里"Okay.", "Right."这类短句和重复念出的代码会出现很多次。
+    translate_lines(unique_lines): 按顺序返回不重复的行的译文
+    limit: api_character_limit，用于估算少发送的包数
+    """
+    positions = {}
+    unique_lines = []
+    index = []
+    for line in lines:
+        key = normalize_text(line)
+        if key not in positions:
+            positions[key] = len(unique_lines)
+            unique_lines.append(key)
+        index.append(positions[key])
+
+    translations = translate_lines(unique_lines)
+
+    saved = sum(len(line) for line in lines) - sum(len(line) for line in unique_lines)
+    if lines:
+        LOGGER.info(
+            f'{name} 去重后翻译{len(unique_lines)} / {len(lines)}行(去重率{1 - len(unique_lines) / len(lines):.1%})，'
+            f'少发送{saved}个字符，约{saved / limit:.1f}个包'
+        )
+    return [translations[i] for i in index]
@@ -0,0 +1,84 @@
+import re
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+import tyro
+
+from asr_backend import load_backend
+from utils import LOGGER, load_audio
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class BenchmarkConfig:
+    """在同一段音频上比较不同语音识别后端的速度和词错误率"""
+
+    # 测试音频
+    audio_path: str = 'assets/audio/test.wav'
+    # 参与比较的后端
+    backends: Tuple[str, ...] = ('whisper', 'ctranslate2')
+    # 模型：tiny | base | small | medium | large
+    whisper_model: str = 'medium'
+    # 只测试音频的前多少秒，0表示整段
+    seconds: int = 300
+    # 参考文本文件。为空时以第一个后端的结果作为参考
+    reference_path: str = ''
+    # 语言，为空时由模型检测
+    language: str = 'en'
+
+
+def normalize_words(text):
+    return re.sub(r"[^\w\s']", ' ', text.lower()).split()
+
+
+def word_error_rate(reference, hypothesis):
+    """词级编辑距离 / 参考文本词数"""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    if not ref:
+        return 0. if not hyp else 1.
+
+    prev = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        curr = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            curr[j] = min(prev[j] + 1, curr[j - 1] + 1, prev[j - 1] + (r != h))
+        prev = curr
+    return prev[-1] / len(ref)
+
+
+def run_backend(backend, config: BenchmarkConfig, audio_np):
+    t0 = time.time()
+    model = load_backend(backend, config.whisper_model)
+    load_seconds = time.time() - t0
+
+    t0 = time.time()
+    result = model.transcribe(audio_np, word_timestamps=True, language=config.language or None)
+    transcribe_seconds = time.time() - t0
+    return result['text'], load_seconds, transcribe_seconds
+
+
+if __name__ == '__main__':
+    args = tyro.cli(BenchmarkConfig)
+
+    audio_np = load_audio(args.audio_path, SAMPLE_RATE)
+    if args.seconds > 0:
+        audio_np = audio_np[:args.seconds * SAMPLE_RATE]
+    audio_seconds = audio_np.size / SAMPLE_RATE
+
+    reference = None
+    if args.reference_path:
+        with open(args.reference_path, 'r', encoding='utf-8') as f:
+            reference = f.read()
+
+    for backend in args.backends:
+        text, load_seconds, transcribe_seconds = run_backend(backend, args, audio_np)
+        if reference is None:
+            reference = text
+            LOGGER.info(f'以{backend}的结果作为参考文本')
+        LOGGER.info(
+            f'[{backend}] 加载 {load_seconds:.1f}s，转文本 {transcribe_seconds:.1f}s / 音频 {audio_seconds:.1f}s，'
+            f'RTF {transcribe_seconds / audio_seconds:.3f}，WER {word_error_rate(reference, text):.2%}'
+        )
@@ -0,0 +1,96 @@
+import json
+import os
+
+from utils import LOGGER
+
+
+def compact_result(result):
+    """只保留SrtAssembler和幻觉过滤需要的信息，每个单词存为[word, start, end, probability, compression_ratio]
+
+    compression_ratio是单词所在片段的压缩比，重新断句时幻觉过滤还要用到它
+    """
+    return [
+        [w['word'], w['start'], w['end'], w.get('probability', 1.), segment.get('compression_ratio', 0.)]
+        for segment in result['segments'] for w in segment['words']
+    ]
+
+
+def expand_result(words):
+    """compact_result的逆操作，还原为whisper结果的结构。压缩比相同的相邻单词放在同一个片段中
+
+    旧格式的单词没有压缩比，当作0
+    """
+    segments = []
+    for w in words:
+        compression_ratio = w[4] if len(w) > 4 else 0.
+        if not segments or segments[-1]['compression_ratio'] != compression_ratio:
+            segments.append({'compression_ratio': compression_ratio, 'words': []})
+        segments[-1]['words'].append({'word': w[0], 'start': w[1], 'end': w[2], 'probability': w[3]})
+    return {'segments': segments}
+
+
+class WindowCheckpoint(object):
+    """转文本的断点文件。每个窗口完成后立即追加一行，进程被杀后重新运行时跳过已完成的窗口
+
+    文件为jsonl格式，第一行记录音频长度和影响结果的参数，参数不一致时断点作废。
+    之后每行为 {"start": 采样点, "end": 采样点, "words": [[word, start, end, probability, compression_ratio], ...]}
+    """
+    def __init__(self, path, fingerprint: dict):
+        self.path = path
+        # 经过一次json往返，元组变为列表，和从文件读回的内容可以直接比较
+        self.fingerprint = json.loads(json.dumps(fingerprint))
+        self.windows = {}
+        self._file = None
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        if not lines or json.loads(lines[0]) != self.fingerprint:
+            LOGGER.warn(f'{self.path} 与当前参数不一致，忽略断点')
+            os.remove(self.path)
+            return
+
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 写到一半被打断的最后一行
+                break
+            self.windows[(record['start'], record['end'])] = record['words']
+        LOGGER.info(f'{self.path} 已完成{len(self.windows)}个窗口，从断点继续')
+
+    def get(self, start, end):
+        """返回窗口的转文本结果，没有记录时返回None"""
+        words = self.windows.get((start, end))
+        if words is None:
+            return None
+        return expand_result(words)
+
+    def save(self, start, end, result):
+        if self._file is None:
+            # 重写已加载的记录，顺带去掉被打断的半行
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._file.write(json.dumps(self.fingerprint) + '\n')
+            for (s, e), words in self.windows.items():
+                self.write_record(s, e, words)
+
+        words = compact_result(result)
+        self.windows[(start, end)] = words
+        self.write_record(start, end, words)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def write_record(self, start, end, words):
+        self._file.write(json.dumps({'start': start, 'end': end, 'words': words}, ensure_ascii=False) + '\n')
+
+    def remove(self):
+        """字幕文件写入完成后删除断点"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
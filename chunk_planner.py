@@ -0,0 +1,93 @@
+import numpy as np
+
+from utils import LOGGER
+
+# Whisper模型默认的采样率
+SAMPLE_RATE = 16000
+
+
+class ChunkPlan(object):
+    """记录一个音频被切成的解码窗口，并统计重叠与重复解码的比例
+
+    chunks: [(start, end), ...] 以采样点为单位
+    """
+    def __init__(self, total_samples, chunks=None):
+        self.total_samples = total_samples
+        self.chunks = list(chunks) if chunks else []
+
+    def add(self, start, end):
+        self.chunks.append((start, end))
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    @property
+    def decoded_samples(self):
+        return sum(end - start for start, end in self.chunks)
+
+    @property
+    def overlap_samples(self):
+        """相邻窗口重叠的采样点数，即被解码了不止一次的音频"""
+        overlap = 0
+        for (_, prev_end), (start, _) in zip(self.chunks, self.chunks[1:]):
+            overlap += max(0, prev_end - start)
+        return overlap
+
+    @property
+    def redecode_ratio(self):
+        """重复解码的音频占音频总长的比例"""
+        if self.total_samples == 0:
+            return 0.
+        return self.decoded_samples / self.total_samples - 1
+
+    def report(self, name='', sr=SAMPLE_RATE):
+        LOGGER.info(
+            f'{name} 共{len(self.chunks)}个窗口，解码 {self.decoded_samples / sr:.1f}s / 音频 {self.total_samples / sr:.1f}s，'
+            f'重叠 {self.overlap_samples / sr:.1f}s，重复解码率 {self.redecode_ratio:.1%}'
+        )
+
+
+def frame_energy_db(audio_np, frame_length):
+    """逐帧计算能量(dB)。不足一帧的尾部丢弃"""
+    num_frames = audio_np.size // frame_length
+    frames = audio_np[:num_frames * frame_length].reshape(num_frames, frame_length)
+    # einsum逐行求平方和，避免生成和音频一样大的临时数组
+    energy = np.einsum('ij,ij->i', frames, frames) / frame_length
+    return 10 * np.log10(energy + 1e-10)
+
+
+def plan_chunks(audio_np, target_seconds=300, search_seconds=30, sr=SAMPLE_RATE, frame_ms=30, smooth_ms=600):
+    """在目标长度附近的静音处切分音频，窗口之间不重叠，每段音频只解码一次
+
+    target_seconds: 窗口的目标长度
+    search_seconds: 在目标位置前后多大范围内寻找静音，必须小于target_seconds，否则切分点可能停在窗口开头
+    smooth_ms: 能量平滑窗口。取一段连续的低能量区域，而不是一个偶然安静的帧
+    """
+    if not 0 <= search_seconds < target_seconds:
+        raise ValueError(f'chunk_search_seconds({search_seconds})必须小于chunk_seconds({target_seconds})')
+    total = audio_np.size
+    plan = ChunkPlan(total)
+    target = int(target_seconds * sr)
+    search = int(search_seconds * sr)
+    if total <= target + search:
+        plan.add(0, total)
+        return plan
+
+    frame_length = int(sr * frame_ms / 1000)
+    energy = frame_energy_db(audio_np, frame_length)
+    smooth_frames = max(1, smooth_ms // frame_ms)
+    if smooth_frames > 1:
+        energy = np.convolve(energy, np.ones(smooth_frames) / smooth_frames, mode='same')
+
+    cursor = 0
+    while total - cursor > target + search:
+        lo = (cursor + target - search) // frame_length
+        hi = min((cursor + target + search) // frame_length, energy.size)
+        boundary = (lo + int(np.argmin(energy[lo:hi]))) * frame_length + frame_length // 2
+        plan.add(cursor, boundary)
+        cursor = boundary
+    plan.add(cursor, total)
+    return plan
@@ -0,0 +1,106 @@
+"""过滤Whisper的幻觉输出
+
+在长时间的静音或音乐上，Whisper经常反复输出同一个短语，或者输出置信度很低的无关内容。
+这些单词会进入字幕，还会作为prompt传给下一个窗口，让幻觉延续下去。
+
+    repetition: 1~max_ngram个词的短语连续出现repeat_threshold次，保留第一遍，之后的重复全部丢弃
+    compression_ratio: 片段文本的压缩比超过阈值(文本高度重复)，整个片段丢弃
+    low_probability: 连续low_probability_run个单词的概率都低于low_probability，丢弃这一段
+"""
+from collections import Counter
+
+from utils import LOGGER
+
+
+def normalize_word(word):
+    return word.strip().strip(',.?!:;，。！？；：、"\'').lower()
+
+
+class HallucinationFilter(object):
+
+    def __init__(self, repeat_threshold=4, compression_ratio_threshold=2.4, low_probability=0.1, low_probability_run=6, max_ngram=4):
+        self.repeat_threshold = repeat_threshold
+        self.compression_ratio_threshold = compression_ratio_threshold
+        self.low_probability = low_probability
+        self.low_probability_run = low_probability_run
+        self.max_ngram = max_ngram
+        # 统计
+        self.reasons = Counter()
+        self.flagged_seconds = 0.
+        # 因为跳过被标记的区域而少解码的音频时长，由调用者累加
+        self.saved_seconds = 0.
+
+    def loop_period(self, keys, j):
+        """keys[:j+1]的结尾是否为某个短语连续重复repeat_threshold次，是则返回短语的词数，否则返回0"""
+        for n in range(1, self.max_ngram + 1):
+            span = n * self.repeat_threshold
+            if j + 1 < span:
+                break
+            tail = keys[j + 1 - span:j + 1]
+            if all(tail[k] == tail[k % n] for k in range(n, span)):
+                return n
+        return 0
+
+    def filter(self, result):
+        """返回(去掉幻觉单词后的result, 被标记的区间[(start, end), ...])，时间与result中相同"""
+        segments = result['segments']
+        words = [(i, word_dict) for i, segment in enumerate(segments) for word_dict in segment.get('words') or []]
+        reasons = [None] * len(words)
+
+        for j, (i, _) in enumerate(words):
+            if segments[i].get('compression_ratio', 0.) > self.compression_ratio_threshold:
+                reasons[j] = 'compression_ratio'
+
+        keys = [normalize_word(word_dict['word']) for _, word_dict in words]
+        for j in range(len(words)):
+            n = self.loop_period(keys, j)
+            if n:
+                for k in range(j + 1 - n * (self.repeat_threshold - 1), j + 1):
+                    reasons[k] = reasons[k] or 'repetition'
+
+        run = 0
+        for j, (_, word_dict) in enumerate(words + [(None, {'probability': 1.})]):
+            if word_dict.get('probability', 1.) < self.low_probability:
+                run += 1
+                continue
+            if run >= self.low_probability_run:
+                for k in range(j - run, j):
+                    reasons[k] = reasons[k] or 'low_probability'
+            run = 0
+
+        flagged = []
+        kept = [[] for _ in segments]
+        for j, ((i, word_dict), reason) in enumerate(zip(words, reasons)):
+            if reason is None:
+                kept[i].append(word_dict)
+                continue
+            self.reasons[reason] += 1
+            # 相邻的被标记单词合并为一个区间
+            if j > 0 and reasons[j - 1] is not None:
+                flagged[-1] = (flagged[-1][0], word_dict['end'])
+            else:
+                flagged.append((word_dict['start'], word_dict['end']))
+
+        if not flagged:
+            return result, []
+
+        self.flagged_seconds += sum(end - start for start, end in flagged)
+        new_segments = [dict(segment, words=kept[i]) for i, segment in enumerate(segments) if kept[i]]
+        return dict(result, segments=new_segments), flagged
+
+    def report(self, name=''):
+        if not self.reasons:
+            return
+        LOGGER.info(
+            f'{name} 丢弃幻觉单词 {dict(self.reasons)}，共{self.flagged_seconds:.1f}s，'
+            f'跳过重复解码 {self.saved_seconds:.1f}s'
+        )
+
+
+def new_filter(config):
+    if not config.filter_hallucination:
+        return None
+    return HallucinationFilter(
+        config.repeat_threshold, config.compression_ratio_threshold,
+        config.low_probability, config.low_probability_run
+    )
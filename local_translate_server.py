@@ -0,0 +1,151 @@
+"""本地翻译替身服务
+
+模拟翻译api的延迟、错误、限流和合并行的毛病，不联网就能测试打包翻译、并发和重试的表现。
+"翻译"结果是把原文中的英文字母转为大写，行号标记等其他字符保持不变。
+
+    POST /translate {"text": 原文, "source": 源语言, "target": 目标语言} -> {"translation": 译文}
+    GET /stats -> 请求数、各类错误数、合并的行数
+
+使用: python local_translate_server.py --latency 0.5 --error-rate 0.05 --merge-rate 0.02
+     python app.py --translator local --translator-url http://127.0.0.1:8765
+模拟不支持打包的api: python local_translate_server.py --single-line
+     python app.py --translator local-line
+"""
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tyro
+
+from utils import LOGGER
+
+MARKER_RE = re.compile(r'^\s*\[\d+\]\s*')
+
+
+@dataclass
+class ServerConfig:
+    """启动本地翻译替身服务"""
+
+    host: str = '127.0.0.1'
+    port: int = 8765
+    # 每个请求的平均延迟(秒)，实际延迟在[latency * 0.5, latency * 1.5]内均匀分布
+    latency: float = 0.3
+    # 返回500错误的概率
+    error_rate: float = 0.
+    # 每秒最多处理的请求数，超出时返回429。0表示不限制
+    requests_per_second: float = 0.
+    # 单次请求的字符上限，超出时返回413
+    max_payload: int = 5000
+    # 每个换行处把下一行合并到这一行的概率。合并时丢掉下一行的行号标记，和真实api的表现一样
+    merge_rate: float = 0.
+    # 只接受单行文本，多行请求返回400，模拟不支持打包的api
+    single_line: bool = False
+    # 随机数种子，便于复现
+    seed: int = 0
+
+
+def fake_translate(text, merge_rate):
+    """返回(译文, 合并的行数)"""
+    lines = text.split('\n')
+    merged = 0
+    output = [lines[0]]
+    for line in lines[1:]:
+        if random.random() < merge_rate:
+            output[-1] += ' ' + MARKER_RE.sub('', line)
+            merged += 1
+        else:
+            output.append(line)
+    return re.sub(r'[a-z]+', lambda m: m.group(0).upper(), '\n'.join(output)), merged
+
+
+class TranslateHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    def send_json(self, code, body):
+        raw = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_json(404, {'error': 'not found'})
+            return
+        with self.server.lock:
+            self.send_json(200, dict(self.server.stats))
+
+    def do_POST(self):
+        if self.path != '/translate':
+            self.send_json(404, {'error': 'not found'})
+            return
+        config: ServerConfig = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+        text = body.get('text', '')
+
+        with self.server.lock:
+            stats = self.server.stats
+            stats['requests'] += 1
+            stats['characters'] += len(text)
+            now = time.monotonic()
+            if config.requests_per_second > 0:
+                # 最近一秒内的请求数超过上限时限流
+                self.server.recent = [t for t in self.server.recent if now - t < 1.]
+                if len(self.server.recent) >= config.requests_per_second:
+                    stats['rate_limited'] += 1
+                    self.send_json(429, {'error': 'too many requests'})
+                    return
+                self.server.recent.append(now)
+            if config.single_line and '\n' in text.strip():
+                stats['multi_line'] += 1
+                self.send_json(400, {'error': 'only one line per request'})
+                return
+            if len(text) > config.max_payload:
+                stats['too_large'] += 1
+                self.send_json(413, {'error': f'payload too large: {len(text)} > {config.max_payload}'})
+                return
+            failed = random.random() < config.error_rate
+            delay = random.uniform(config.latency * 0.5, config.latency * 1.5)
+
+        time.sleep(delay)
+        if failed:
+            with self.server.lock:
+                self.server.stats['errors'] += 1
+            self.send_json(500, {'error': 'internal error'})
+            return
+
+        translation, merged = fake_translate(text, config.merge_rate)
+        with self.server.lock:
+            self.server.stats['merged_lines'] += merged
+        self.send_json(200, {'translation': translation})
+
+
+class TranslateServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.recent = []
+        self.stats = {'requests': 0, 'characters': 0, 'errors': 0, 'rate_limited': 0, 'too_large': 0, 'multi_line': 0, 'merged_lines': 0}
+        super().__init__((config.host, config.port), TranslateHandler)
+
+
+if __name__ == '__main__':
+    args = tyro.cli(ServerConfig)
+    random.seed(args.seed)
+
+    server = TranslateServer(args)
+    LOGGER.info(f'本地翻译替身服务已启动 http://{args.host}:{args.port}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        LOGGER.info(f'统计: {server.stats}')
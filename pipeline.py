@@ -0,0 +1,105 @@
+import threading
+import time
+from queue import Queue
+
+from utils import LOGGER
+
+# 队列结束标记
+_STOP = object()
+
+
+class Stage(object):
+    """流水线中的一个阶段
+
+    func: 处理单个条目，返回值交给下一阶段。返回None表示该条目到此为止
+    concurrency: 该阶段同时处理的条目数(线程数)
+    """
+    def __init__(self, name, func, concurrency=1):
+        self.name = name
+        self.func = func
+        self.concurrency = max(1, concurrency)
+        self.busy_time = 0.
+        self.processed = 0
+        self._lock = threading.Lock()
+        self._alive = 0
+
+    def run(self, in_queue: Queue, out_queue: Queue):
+        while True:
+            item = in_queue.get()
+            if item is _STOP:
+                # 放回去让同阶段的其他线程也能退出
+                in_queue.put(_STOP)
+                break
+
+            start_time = time.time()
+            try:
+                result = self.func(item)
+            except Exception as e:
+                LOGGER.error(f'[{self.name}] {item} 处理出错: {e}')
+                result = None
+            with self._lock:
+                self.busy_time += time.time() - start_time
+                self.processed += 1
+
+            if result is not None and out_queue is not None:
+                out_queue.put(result)
+
+        with self._lock:
+            self._alive -= 1
+            last = self._alive == 0
+        # 最后一个退出的线程通知下游
+        if last and out_queue is not None:
+            out_queue.put(_STOP)
+
+
+class Pipeline(object):
+    """用有界队列串联多个阶段。每个条目完成一个阶段后立即进入下一阶段，
+    各阶段并发执行，总耗时趋近于最慢的阶段。
+
+    queue_size: 阶段间队列的容量。下游处理不过来时上游会阻塞，避免中间结果堆积
+    """
+    def __init__(self, stages, queue_size=2):
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+
+    def run(self, items):
+        queues = [Queue(maxsize=self.queue_size) for _ in self.stages]
+        # 收集最后一个阶段的输出，不设上限以免阻塞
+        queues.append(Queue())
+
+        threads = []
+        for i, stage in enumerate(self.stages):
+            stage._alive = stage.concurrency
+            for j in range(stage.concurrency):
+                t = threading.Thread(
+                    target=stage.run, args=(queues[i], queues[i + 1]),
+                    name=f'{stage.name}-{j}', daemon=True
+                )
+                t.start()
+                threads.append(t)
+
+        start_time = time.time()
+        for item in items:
+            queues[0].put(item)
+        queues[0].put(_STOP)
+
+        for t in threads:
+            t.join()
+        elapsed = time.time() - start_time
+
+        results = []
+        while not queues[-1].empty():
+            item = queues[-1].get()
+            if item is not _STOP:
+                results.append(item)
+
+        self.report(elapsed)
+        return results
+
+    def report(self, elapsed):
+        for stage in self.stages:
+            # 阶段耗时 = 忙碌时间 / 并发数，即该阶段单独运行所需的时间
+            stage_time = stage.busy_time / stage.concurrency
+            LOGGER.info(f'[{stage.name}] 处理{stage.processed}项，并发{stage.concurrency}，忙碌{stage.busy_time:.1f}s，约合{stage_time:.1f}s')
+        slowest = max((s.busy_time / s.concurrency for s in self.stages), default=0.)
+        LOGGER.info(f'流水线总耗时 {elapsed:.1f}s，最慢阶段 {slowest:.1f}s')
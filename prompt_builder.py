@@ -0,0 +1,72 @@
+from utils import LOGGER
+
+# Whisper只使用prompt的最后 n_text_ctx // 2 - 1 = 223 个token
+MAX_PROMPT_TOKENS = 223
+
+
+# 百度翻译的语言代码 -> Whisper的语言代码
+BAIDU_LANGUAGES = {
+    'jp': 'ja', 'kor': 'ko', 'fra': 'fr', 'spa': 'es', 'ara': 'ar', 'bul': 'bg', 'est': 'et',
+    'dan': 'da', 'fin': 'fi', 'rom': 'ro', 'slo': 'sl', 'swe': 'sv', 'vie': 'vi', 'cht': 'zh', 'wyw': 'zh',
+}
+
+
+def whisper_language(config):
+    """Whisper的识别语言，返回None时由模型检测
+
+    whisper_lang不为空时直接使用，auto表示检测。
+    为空时只有task为transcribe才由src_lang推出: translate任务的src_lang是Whisper输出的英文，不是音频的语言。
+    src_lang是翻译api的语言代码，如zh-CN -> zh，百度的jp -> ja，Whisper不支持的代码交给模型检测。
+    """
+    language = config.whisper_lang
+    if not language:
+        if config.task != 'transcribe':
+            return None
+        language = config.src_lang
+        if language:
+            language = language.split('-')[0].lower()
+            language = BAIDU_LANGUAGES.get(language, language)
+    if not language or language == 'auto':
+        return None
+
+    try:
+        from whisper.tokenizer import LANGUAGES, TO_LANGUAGE_CODE
+    except ImportError:
+        return language
+    language = TO_LANGUAGE_CODE.get(language, language)
+    if language not in LANGUAGES:
+        LOGGER.warn(f'Whisper不支持语言代码 {language}，改为自动检测')
+        return None
+    return language
+
+
+class PromptBuilder(object):
+    """按token预算拼接prompt
+
+    Whisper只保留prompt最后的223个token，上一句太长时，排在前面的固定prompt(专有名词等)会被截掉。
+    这里固定部分只分词一次，之后每个窗口只对上一句分词，并从左边截断上一句，保证固定部分完整保留。
+    """
+    def __init__(self, static_prompt, model_name='medium', max_tokens=MAX_PROMPT_TOKENS):
+        self.static_prompt = static_prompt.strip()
+        try:
+            from whisper.tokenizer import get_tokenizer
+            tokenizer = get_tokenizer(multilingual=not model_name.endswith('.en'))
+            self.encode, self.decode = tokenizer.encode, tokenizer.decode
+        except ImportError:
+            # 没有安装whisper时按空格粗略估计
+            self.encode, self.decode = str.split, ' '.join
+
+        self.static_tokens = len(self.encode(' ' + self.static_prompt)) if self.static_prompt else 0
+        self.budget = max_tokens - self.static_tokens
+        if self.budget <= 0:
+            LOGGER.warn(f'whisper_prompt有{self.static_tokens}个token，超过{max_tokens}的部分会被Whisper忽略')
+
+    def build(self, context=''):
+        context = context.strip()
+        if not context or self.budget <= 0:
+            return self.static_prompt
+
+        tokens = self.encode(' ' + context)
+        if len(tokens) > self.budget:
+            context = self.decode(tokens[-self.budget:]).strip()
+        return (self.static_prompt + ' ' + context).strip()
@@ -0,0 +1,68 @@
+"""双语字幕中原文的哈希
+
+生成双语字幕时，以开始时间为键，把每条字幕原文的哈希存到旁边的.hashes.json文件。
+校对修改原文后，只有哈希和同一时间的记录不一致的字幕需要重新翻译。
+按开始时间而不是按位置对应，编辑器中合并、删除字幕后其他字幕仍能对上；
+也不按集合比较，"Right."改成另一条字幕原有的"Okay."时同样会重新翻译。
+"""
+import hashlib
+import json
+import os
+import re
+
+from src.ass_container import AssContainer
+from src.srt_container import Clip, SrtContainer
+from translation_memory import normalize_text
+
+# ass字幕中的{\rEN}等样式标签
+ASS_TAG_RE = re.compile(r'\{[^}]*\}')
+
+
+def source_hash(text):
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()[:16]
+
+
+def hashes_path(subtitle_path):
+    return subtitle_path + '.hashes.json'
+
+
+def load_subtitles(subtitle_path):
+    """按文件内容而不是后缀选择容器: 字幕编辑器会把srt格式的内容写到.ass后缀的路径"""
+    with open(subtitle_path, 'r', encoding='utf-8') as f:
+        is_ass = '[Script Info]' in f.readline()
+    container = AssContainer() if is_ass else SrtContainer()
+    container.load_srt(subtitle_path)
+    return container
+
+
+def save_source_hashes(subtitle_path, clips=None):
+    """clips: 字幕文件中的字幕，不提供时读取刚写入的字幕文件"""
+    if clips is None:
+        clips = load_subtitles(subtitle_path).clips
+    with open(hashes_path(subtitle_path), 'w', encoding='utf-8') as f:
+        json.dump({'hashes': {clip.start: source_hash(clip_source_text(clip)) for clip in clips}}, f)
+
+
+def load_source_hashes(subtitle_path):
+    """返回{开始时间: 哈希}，没有记录或是旧格式的记录时返回None"""
+    path = hashes_path(subtitle_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        hashes = json.load(f)['hashes']
+    return hashes if isinstance(hashes, dict) else None
+
+
+def edited_clips(clips, hashes):
+    """返回原文改动过的字幕的下标"""
+    edited = []
+    for i, clip in enumerate(clips):
+        text = clip_source_text(clip)
+        if text and hashes.get(clip.start) != source_hash(text):
+            edited.append(i)
+    return edited
+
+
+def clip_source_text(clip: Clip):
+    """双语字幕中原文在第二行，加载后存放在target_text中"""
+    return ASS_TAG_RE.sub('', clip.target_text).strip()
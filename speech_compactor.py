@@ -0,0 +1,135 @@
+"""去掉音频中的长静音，只把语音部分交给模型
+
+讲座录音里经常有长时间的停顿、问答间隙，这些音频照样要花时间解码。
+解码前把语音区间拼接成一段更短的音频，单词的时间再通过OffsetMap映射回原音频。
+按能量判断静音，片头音乐这类有声音的非语音部分不会被去掉。
+音频来自音频缓存(memmap)时，压缩后的音频也写到缓存目录中用memmap读取，不会把整段语音读入内存。
+"""
+import os
+from bisect import bisect_right
+
+import numpy as np
+
+from chunk_planner import SAMPLE_RATE, frame_energy_db
+from utils import LOGGER
+
+# 每段语音两侧保留的静音(秒)，拼接处留出停顿，Whisper才能正常断句
+SPEECH_PADDING_SECONDS = 0.3
+# 能去掉的静音不到这个比例时不压缩
+MIN_COMPACT_RATIO = 0.05
+
+
+class OffsetMap(object):
+    """压缩后音频中的时间与原音频中的时间(秒)互相转换
+
+    spans: 保留下来的语音区间[(start, end), ...]，原音频的采样点，按顺序首尾相接组成压缩后的音频
+    """
+    def __init__(self, spans, sr=SAMPLE_RATE):
+        self.spans = [(int(start), int(end)) for start, end in spans]
+        self.orig_starts = [start / sr for start, _ in self.spans]
+        self.lengths = [(end - start) / sr for start, end in self.spans]
+        self.compact_starts = []
+        position = 0.
+        for length in self.lengths:
+            self.compact_starts.append(position)
+            position += length
+
+    @property
+    def compact_seconds(self):
+        return self.compact_starts[-1] + self.lengths[-1] if self.spans else 0.
+
+    def span_at(self, t):
+        return max(0, bisect_right(self.compact_starts, t) - 1)
+
+    def to_original(self, t):
+        i = self.span_at(t)
+        return self.orig_starts[i] + t - self.compact_starts[i]
+
+    def to_compact(self, t):
+        """落在被去掉的静音中的时间，映射到前一段语音的结尾"""
+        i = max(0, bisect_right(self.orig_starts, t) - 1)
+        return self.compact_starts[i] + min(t - self.orig_starts[i], self.lengths[i])
+
+    def map_word(self, start, end):
+        """单词跨过拼接处时，归到它占得更多的那一段语音"""
+        i, j = self.span_at(start), self.span_at(end)
+        if i == j:
+            return self.to_original(start), self.to_original(end)
+        seam = self.compact_starts[i] + self.lengths[i]
+        if seam - start >= end - self.compact_starts[j]:
+            return self.to_original(start), self.orig_starts[i] + self.lengths[i]
+        return self.orig_starts[j], self.to_original(end)
+
+
+def find_speech_spans(audio_np, min_silence_seconds=2., threshold_db=35., sr=SAMPLE_RATE, frame_ms=30):
+    """返回语音区间[(start, end), ...]，单位为采样点
+
+    比音频中较响部分(95%分位)低threshold_db以上、且持续min_silence_seconds以上的区域视为静音
+    """
+    frame_length = int(sr * frame_ms / 1000)
+    energy = frame_energy_db(audio_np, frame_length)
+    if energy.size == 0:
+        return [(0, audio_np.size)]
+
+    silent = energy < np.percentile(energy, 95) - threshold_db
+    # 找出连续静音帧的起止位置
+    edges = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+
+    min_frames = int(min_silence_seconds * 1000 / frame_ms)
+    padding = int(SPEECH_PADDING_SECONDS * sr)
+    spans = []
+    cursor = 0
+    for run_start, run_end in zip(run_starts, run_ends):
+        if run_end - run_start < min_frames:
+            continue
+        gap_start = run_start * frame_length + (padding if run_start > 0 else 0)
+        gap_end = run_end * frame_length - (padding if run_end < silent.size else 0)
+        if gap_end == silent.size * frame_length:
+            # 不足一帧的尾部也是静音
+            gap_end = audio_np.size
+        if gap_start < gap_end:
+            if gap_start > cursor:
+                spans.append((cursor, gap_start))
+            cursor = gap_end
+    if cursor < audio_np.size:
+        spans.append((cursor, audio_np.size))
+    return spans
+
+
+def compact_path(audio_path, min_silence_seconds, threshold_db):
+    """音频缓存文件对应的压缩后音频的路径，文件名中带有压缩参数"""
+    root, ext = os.path.splitext(audio_path)
+    return f'{root}_speech{min_silence_seconds:g}_{threshold_db:g}{ext}'
+
+
+def write_compact(audio_np, spans, path, chunk_size=1 << 20):
+    """逐块把语音区间写入path，返回它的memmap。文件已存在且长度正确时直接使用"""
+    kept = sum(end - start for start, end in spans)
+    if not os.path.exists(path) or os.path.getsize(path) != kept * 4:
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for start, end in spans:
+                for chunk_start in range(start, end, chunk_size):
+                    np.asarray(audio_np[chunk_start:min(end, chunk_start + chunk_size)], dtype=np.float32).tofile(f)
+        os.replace(tmp_path, path)
+    return np.memmap(path, dtype=np.float32, mode='r')
+
+
+def compact_speech(audio_np, min_silence_seconds=2., threshold_db=35., name='', sr=SAMPLE_RATE):
+    """返回(压缩后的音频, OffsetMap)。可去掉的静音太少时返回(原音频, None)"""
+    spans = find_speech_spans(audio_np, min_silence_seconds, threshold_db, sr)
+    kept = sum(end - start for start, end in spans)
+    if not spans or audio_np.size - kept < audio_np.size * MIN_COMPACT_RATIO:
+        return audio_np, None
+
+    LOGGER.info(
+        f'{name} 去掉静音 {(audio_np.size - kept) / sr:.1f}s，解码 {kept / sr:.1f}s / 音频 {audio_np.size / sr:.1f}s，'
+        f'减少 {1 - kept / audio_np.size:.1%}'
+    )
+    if isinstance(audio_np, np.memmap) and audio_np.filename and audio_np.offset == 0 and audio_np.dtype == np.float32:
+        compact = write_compact(audio_np, spans, compact_path(audio_np.filename, min_silence_seconds, threshold_db))
+    else:
+        compact = np.concatenate([audio_np[start:end] for start, end in spans])
+    return compact, OffsetMap(spans, sr)
@@ -1,7 +1,7 @@
 import os
 
 from utils import LOGGER, timestring_to_ms
-from src.srt_container import Clip
+from src.srt_container import Clip, ClipIndex
 
 
 SCRIPT_INFO = """
@@ -29,6 +29,7 @@ class AssContainer(object):
         self.current_index = -1
         self.styles = []
         self.valid_style_names = []
+        self.index = ClipIndex()
 
     def is_empty(self) -> bool:
         return len(self.clips) == 0
@@ -52,14 +53,21 @@ class AssContainer(object):
         if self.current_index == 0:
             return None
         self.clips.pop(self.current_index - 1)
+        self.index.remove(self.current_index - 1)
+        self.current_index -= 1
 
     def remove_next_clip(self):
         if self.current_index + 2 > len(self.clips):
             return None
         self.clips.pop(self.current_index + 1)
+        self.index.remove(self.current_index + 1)
 
     def udpate_current_clip(self, new_text):
         self.clips[self.current_index].update_text(new_text)
+
+    def refresh_clip_time(self):
+        """当前字幕的起止时间被修改后调用"""
+        self.index.update(self.current_index, self.get_current_clip())
     
     def get_start_time_ms(self):
         return timestring_to_ms(self.start, ass=True)
@@ -76,28 +84,29 @@ class AssContainer(object):
             LOGGER.warn('没有要更新的片段')
             return
         
+        # 重新转文本后当前字幕的结束时间也变了
+        self.refresh_clip_time()
         for c in reversed(clip.next_clips):
             self.clips.insert(self.current_index + 1, c)
+            self.index.insert(self.current_index + 1, c)
 
     def update_current_clip(self, play_time: float) -> bool:
         if self.get_current_clip() is None:
             return 
 
-        if self.get_current_clip().time_in_clip(play_time):
+        if self.index.contains(self.current_index, play_time):
             return False
         
-        if self.clips[self.current_index + 1].time_in_clip(play_time):
+        if self.index.contains(self.current_index + 1, play_time):
             self.current_index += 1
         else:
-            for i in range(len(self.clips)):
-                if self.clips[i].get_end_time_ms() > play_time:
-                    break
-            self.current_index = i
+            self.current_index = self.index.find(play_time)
         
         return True
     
     def load_srt(self, path):
         self.clips.clear()
+        self.index.build(self.clips)
         if not os.path.isfile(path):
             LOGGER.error(f"字幕加载失败，路径{path}不存在")
             return
@@ -127,7 +136,7 @@ class AssContainer(object):
                 if line.startswith('Comment'):
                     continue
                 elif line.startswith('Dialogue'):
-                    params = line.split(': ')[1].split(',', maxsplit=9)
+                    params = line.split(': ', 1)[1].split(',', maxsplit=9)
                     clip = Clip(self.valid_style_names)
                     clip.type = 'ass'
                     clip.set_id(lineno)
@@ -147,7 +156,7 @@ class AssContainer(object):
                     LOGGER.warning(f"ASS FORMAT INVALID at {lineno}: {line}")
             elif current_section == 'style':
                 if line.startswith('Style'):
-                    params = line.split(': ')[1].split(',')
+                    params = line.split(': ', 1)[1].split(',')
                     self.valid_style_names.append(params[0])
                     self.styles.append({
                         'Name': params[0],
@@ -178,6 +187,8 @@ class AssContainer(object):
             else:
                 continue
 
+        self.index.build(self.clips)
+
     def export_srt(self):
         srt_text = SCRIPT_INFO + '\n\n' + STYLES + '\n\n' + '[Events]\n' + 'Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n'
         
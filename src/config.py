@@ -7,27 +7,88 @@ class AppConfig:
     srt_dir: str = "assets/srt/"
     mkv_dir: str = "assets/mkv/"
     subtitle_type: str = ".ass"
+    # whisper_daemon.py在运行时，通过它转文本，不在本进程加载模型
+    use_daemon: bool = True
+    # 转文本服务的Unix socket路径
+    daemon_socket: str = "assets/cache/whisper.sock"
+    # 从视频直接解码出16kHz单声道wav，跳过mp3转码和之后的二次解码。关闭时提取为mp3
+    fast_extract: bool = True
+    # 缓存目录。保存Whisper的单词级结果等
+    cache_dir: str = "assets/cache/"
+    # 缓存解码后的音频，用memmap读取，命令行和字幕编辑器共用
+    use_audio_cache: bool = True
+    # 音频缓存的大小上限(GB)，超出时删除最久没用的文件
+    audio_cache_max_gb: float = 10.
+    # 缓存每个窗口的单词级结果，相同音频和参数不再重复转文本
+    use_word_cache: bool = True
     # 模型：tiny | base | small | medium | large | downloaded_model_path
     whisper_model: str = 'medium' 
+    # 语音识别后端 whisper: PyTorch推理 | ctranslate2: faster-whisper的int8量化推理，纯CPU时更快(需安装faster-whisper)
+    asr_backend: str = 'whisper'
     # 只有最后224个token会被使用。'Hello, welcome to my lecture.'可以减少无标点符号的情况。之后的部分建议写一些可能很难识别的专用名词。此外，每一句话的前一句也会通过该脚本添加到prompt中。因此，这里的prompt长度建议不超过120个单词。
     # whisper_prompt: str = "Hello, welcome to my lecture. Game dev about splines, bezier curve, De Casteljau's algorithm jerk."
     # whisper_prompt: str = 'こんにちは、私の講義へようこそ。'
     whisper_prompt: str = 'Hello, welcome to my lecture. And this is a video about Godot game dev. Slay The Spire, bat, crab, bats, setter, getter, .tscn, packed scene, .gd, .res'
     # 用逗号断句的句子长度阈值
     comma_as_end_threshold: int = 80
+    # 单条字幕的最长时长(秒)。Whisper漏掉标点时在停顿最长处强制断句。0表示不限制
+    max_cue_duration: float = 15.
+    # 单条字幕的最大字符数，超出时同样强制断句。0表示不限制
+    max_line_length: int = 160
+    # 期望的每秒字符数上限，只是偏好: 强制断句时优先选不超过它的位置，按标点结束的字幕不受影响。0表示不考虑
+    preferred_cps: float = 25.
+    # 丢弃Whisper的幻觉输出(短语循环、连续低置信度单词、压缩比过高的片段)
+    filter_hallucination: bool = True
+    # 1~4个词的短语连续重复多少次视为循环
+    repeat_threshold: int = 4
+    # 片段文本的压缩比超过该值时整段丢弃
+    compression_ratio_threshold: float = 2.4
+    # 连续low_probability_run个单词的概率都低于low_probability时丢弃
+    low_probability: float = 0.1
+    low_probability_run: int = 6
+    # 解码前去掉长静音，只把语音部分拼接起来交给模型，单词时间再映射回原音频
+    compact_speech: bool = True
+    # 至少持续多少秒的静音才去掉
+    min_silence_seconds: float = 2.
+    # 比音频中较响的部分低多少dB视为静音
+    silence_threshold_db: float = 35.
+    # 切分长音频的策略 silence: 在静音处切分，每段只解码一次 | sentence: 从上一窗口最后一句的结尾重新开始
+    chunk_strategy: str = 'silence'
+    # 每个解码窗口的目标长度(秒)
+    chunk_seconds: int = 360
+    # sentence策略下窗口没有任何输出时，缩短到多少秒重试一次
+    min_chunk_seconds: int = 30
+    # silence策略下，在目标长度前后多少秒内寻找静音，必须小于chunk_seconds
+    chunk_search_seconds: int = 30
     # 调用翻译api每次发送的字符上限, 建议英文4500，日文1600。否则可能会报API server error.
     api_character_limit = 4200
     # 任务类型 transcribe | translate
     task: str = 'transcribe'
     # 翻译后只保留中文字幕
     only_zh: bool = False
-    # 使用百度api
+    # 翻译后端 google | baidu | local | local-line: 本地翻译替身服务(local_translate_server.py)，用于不联网测试，local-line逐行发送
+    translator: str = 'google'
+    # local后端的服务地址
+    translator_url: str = 'http://127.0.0.1:8765'
+    # 使用百度api，等同于translator为baidu
     use_baidu_api: bool = False
     # 使用chatglm-6b进行翻译。 速度慢，效果也差。
     # use_chatglm: bool = False
     baidu_appid: str = ''
     baidu_appkey: str = ''
-    # 翻译源语言
+    # 翻译源语言，使用翻译api的语言代码
     src_lang: str = 'en'
+    # Whisper的识别语言，如ja。auto表示由Whisper在每个文件开头检测一次。
+    # 为空时task为transcribe则由src_lang推出(百度的jp、kor等会转换)，task为translate则检测
+    whisper_lang: str = ''
     # 翻译目标语言
     tgt_lang: str = 'zh'
+    # 同时发出的翻译请求数
+    translate_workers: int = 4
+    # 每个翻译后端每秒最多发出的请求数，以及允许的突发请求数
+    requests_per_second: float = 2.
+    request_burst: int = 4
+    # 翻译请求失败时的最大重试次数，重试间隔按指数增长并加入随机抖动
+    max_retries: int = 5
+    # 翻译过的句子存入翻译记忆(cache_dir下的SQLite数据库)，相同的句子不再调用翻译api
+    use_translation_memory: bool = True
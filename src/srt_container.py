@@ -1,4 +1,5 @@
 import os
+from bisect import bisect_left, bisect_right
 
 from utils import LOGGER, timestring_to_ms
 
@@ -86,11 +87,67 @@ class Clip(object):
                 LOGGER.warn(f'ass 字幕格式错误 {all_text}')
 
 
+class ClipIndex(object):
+    """播放时间 -> 字幕序号的索引
+
+    每条字幕的起止时间解析一次存成毫秒整数，starts按时间排序，查找时二分。
+    max_ends[i]是前i+1条字幕结束时间的最大值，单调不减，字幕时间有重叠时也能二分找到第一条还没结束的字幕。
+    """
+    def __init__(self) -> None:
+        self.starts = []
+        self.ends = []
+        self.max_ends = []
+
+    def build(self, clips):
+        self.starts = [clip.get_start_time_ms() for clip in clips]
+        self.ends = [clip.get_end_time_ms() for clip in clips]
+        self.refresh_max_ends(0)
+
+    def refresh_max_ends(self, i):
+        """重算max_ends[i:]"""
+        del self.max_ends[i:]
+        max_end = self.max_ends[-1] if self.max_ends else 0
+        for end in self.ends[i:]:
+            max_end = max(max_end, end)
+            self.max_ends.append(max_end)
+
+    def insert(self, i, clip):
+        self.starts.insert(i, clip.get_start_time_ms())
+        self.ends.insert(i, clip.get_end_time_ms())
+        self.refresh_max_ends(i)
+
+    def remove(self, i):
+        self.starts.pop(i)
+        self.ends.pop(i)
+        self.refresh_max_ends(i)
+
+    def update(self, i, clip):
+        """字幕的时间被修改后调用"""
+        self.starts[i] = clip.get_start_time_ms()
+        self.ends[i] = clip.get_end_time_ms()
+        self.refresh_max_ends(i)
+
+    def contains(self, i, ptime):
+        return 0 <= i < len(self.starts) and self.starts[i] < ptime < self.ends[i]
+
+    def find(self, ptime):
+        """返回包含ptime的字幕序号。没有时返回ptime之后的第一条字幕，已过最后一条时返回最后一条"""
+        # 结束时间大于ptime的第一条字幕
+        first = bisect_right(self.max_ends, ptime)
+        # 开始时间小于ptime的最后一条字幕
+        last = bisect_left(self.starts, ptime) - 1
+        for i in range(first, last + 1):
+            if self.contains(i, ptime):
+                return i
+        return min(first, len(self.starts) - 1)
+
+
 class SrtContainer(object):
 
     def __init__(self) -> None:
         self.clips = []
         self.current_index = -1
+        self.index = ClipIndex()
 
     def is_empty(self) -> bool:
         return len(self.clips) == 0
@@ -113,6 +170,10 @@ class SrtContainer(object):
     def udpate_current_clip(self, new_text):
         self.clips[self.current_index].update_text(new_text)
 
+    def refresh_clip_time(self):
+        """当前字幕的起止时间被修改后调用"""
+        self.index.update(self.current_index, self.get_current_clip())
+
     def get_timeline(self, t):
         """1234.12 -> xx:xx:xx,xxx (h:m:s,ms)"""
         seconds = int(t)
@@ -128,21 +189,19 @@ class SrtContainer(object):
         if self.get_current_clip() is None:
             return 
 
-        if self.get_current_clip().time_in_clip(play_time):
+        if self.index.contains(self.current_index, play_time):
             return False
         
-        if self.clips[self.current_index + 1].time_in_clip(play_time):
+        if self.index.contains(self.current_index + 1, play_time):
             self.current_index += 1
         else:
-            for i in range(len(self.clips)):
-                if self.clips[i].get_end_time_ms() > play_time:
-                    break
-            self.current_index = i
+            self.current_index = self.index.find(play_time)
         
         return True
 
     def load_srt(self, path):
         self.clips.clear()
+        self.index.build(self.clips)
         if not os.path.isfile(path):
             LOGGER.error(f"字幕加载失败，路径{path}不存在")
             return
@@ -169,7 +228,11 @@ class SrtContainer(object):
                 clip.set_time_range(line)
             elif line != "":
                 all_text.append(line)
-        clip.set_text("\n".join(all_text))
+        # 空文件没有最后一条字幕
+        if clip.start or all_text:
+            clip.set_text("\n".join(all_text))
+            self.clips.append(clip)
+        self.index.build(self.clips)
         self.current_index = 0
             
     def export_srt(self):
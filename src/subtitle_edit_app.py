@@ -313,6 +313,7 @@ class Application(ttk.Window):
         cur_clip.source_text += next_clip.source_text
         cur_clip.target_text += next_clip.target_text
         cur_clip.end = next_clip.end
+        self.subtitle_container.refresh_clip_time()
         self.subtitle_container.remove_next_clip()
         self.update_clip(self.mp.player.get_time(), force=True)
     
@@ -328,6 +329,7 @@ class Application(ttk.Window):
         cur_clip = self.subtitle_container.get_current_clip()
         next_clip = self.subtitle_container.get_current_next_clip()
         cur_clip.end = next_clip.start
+        self.subtitle_container.refresh_clip_time()
         self.update_clip(self.mp.player.get_time(), force=True)
 
     def on_export_mkv(self):
@@ -1,15 +1,21 @@
 import os
-import time
 import warnings
 
-import whisper
-from deep_translator import BaiduTranslator, GoogleTranslator
 from rich.console import Console
 
-from srt_assembler import SrtAssembler
+from audio_cache import AudioCache
+from batch_packer import BatchPacker, translate_unique
+from prompt_builder import PromptBuilder, whisper_language
+from source_hashes import save_source_hashes
+from transcriber import Transcriber, new_assembler
+from translation_executor import TranslationExecutor
+from translation_memory import TranslationMemory
+from translators import load_translator, payload_limit, translator_name
 from src.config import AppConfig
 from src.srt_container import Clip
-from utils import LOGGER, ensure_folder_exists, extract_sound_from_video
+from utils import LOGGER, ensure_folder_exists, extract_pcm_from_video, extract_sound_from_video, load_audio
+from whisper_daemon import load_model
+from word_cache import WordCache
 
 warnings.filterwarnings('ignore')
 CONSOLE = Console()
@@ -24,27 +30,48 @@ class WhisperAgent(object):
         self.config = config
         self.model = None
         self.audio_np = None
+        self.word_cache = WordCache(config.cache_dir) if config.use_word_cache else None
+        self.audio_cache = AudioCache(config.cache_dir, int(config.audio_cache_max_gb * 1024**3), SAMPLE_RATE) if config.use_audio_cache else None
+        self.memory = TranslationMemory(config.cache_dir) if config.use_translation_memory else None
 
         self.update_video_path()
 
-        if self.config.use_baidu_api:
-            self.translator = BaiduTranslator(
-                source=self.config.src_lang, target=self.config.tgt_lang, 
-                appid=self.config.baidu_appid, appkey=self.config.baidu_appkey
-            )
-        else:
-            if self.config.tgt_lang == 'zh':
-                self.config.tgt_lang = 'zh-CN'
-            # 有最多5000字符限制
-            self.translator = GoogleTranslator(source=self.config.src_lang, target=self.config.tgt_lang)
+        self.executor = TranslationExecutor(
+            self.new_translator, translator_name(self.config),
+            self.config.translate_workers, self.config.requests_per_second, self.config.request_burst, self.config.max_retries
+        )
+
+    def new_translator(self):
+        return load_translator(
+            translator_name(self.config), self.config.src_lang, self.config.tgt_lang,
+            appid=self.config.baidu_appid, appkey=self.config.baidu_appkey, url=self.config.translator_url
+        )
     
     def translate(self, text):
-        return self.translator.translate(text)
+        if self.memory is None:
+            return self.executor.translate(text)
+        return self.memory.translate(
+            self.executor.backend, self.config.src_lang, self.config.tgt_lang, [text],
+            lambda lines: [self.executor.translate(lines[0])]
+        )[0]
+
+    def translate_lines(self, subtitles):
+        if self.memory is None:
+            return self.batch_translate(subtitles)
+        return self.memory.translate(
+            self.executor.backend, self.config.src_lang, self.config.tgt_lang, subtitles, self.batch_translate
+        )
+
+    def batch_translate(self, subtitles):
+        packer = BatchPacker(payload_limit(self.executor.backend, self.config.api_character_limit))
+        translated_subtitles = packer.translate(subtitles, self.executor.translate, self.executor.map)
+        packer.report()
+        return translated_subtitles
     
     def tanscribe(self, clip: Clip):
         if not self.model:
             with CONSOLE.status('模型加载中...'):
-                self.model = whisper.load_model(self.config.whisper_model)
+                self.model = load_model(self.config.whisper_model, self.config.daemon_socket, self.config.use_daemon, self.config.asr_backend)
         
         self.prepare_audio()
         
@@ -52,16 +79,17 @@ class WhisperAgent(object):
         clip_end = int((clip.get_end_time_ms()) / 1000 * SAMPLE_RATE)
 
         # 用prompt
-        result = self.model.transcribe(self.audio_np[clip_start:clip_end], word_timestamps=True, initial_prompt=self.config.whisper_prompt + clip.target_text, task=self.config.task)
+        prompt = PromptBuilder(self.config.whisper_prompt, self.config.whisper_model).build(clip.target_text)
+        result = self.model.transcribe(self.audio_np[clip_start:clip_end], word_timestamps=True, initial_prompt=prompt, task=self.config.task, language=whisper_language(self.config))
 
-        sa = SrtAssembler(self.config.comma_as_end_threshold)
+        sa = new_assembler(self.config)
         for segment in result['segments']:
             for word_dict in segment['words']:
                 sa.get_next_input(word_dict, offset=clip_start/SAMPLE_RATE)
-        LOGGER.debug(sa.srt_lines)
-        clip.end = clip.get_ass_timeline(sa.srt_lines[0]['end'])
-        clip.target_text = '{\\rEN}' + sa.srt_lines[0]['text']
-        clip.source_text = self.translate(sa.srt_lines[0]['text'])
+        LOGGER.debug([line.text for line in sa.srt_lines])
+        clip.end = clip.get_ass_timeline(sa.srt_lines[0].end)
+        clip.target_text = '{\\rEN}' + sa.srt_lines[0].text
+        clip.source_text = self.translate(sa.srt_lines[0].text)
 
         if len(sa.srt_lines) == 1:
             return
@@ -70,10 +98,10 @@ class WhisperAgent(object):
             next_clip = Clip()
             next_clip.set_id('666')
             next_clip.type = 'ass'
-            next_clip.start = next_clip.get_ass_timeline(line['start'])
-            next_clip.end = next_clip.get_ass_timeline(line['end'])
-            next_clip.target_text = '{\\rEN}' + line['text']
-            next_clip.source_text = self.translate(line['text'])
+            next_clip.start = next_clip.get_ass_timeline(line.start)
+            next_clip.end = next_clip.get_ass_timeline(line.end)
+            next_clip.target_text = '{\\rEN}' + line.text
+            next_clip.source_text = self.translate(line.text)
             next_clip.style = clip.style.copy()
             clip.next_clips.append(next_clip)
 
@@ -81,7 +109,10 @@ class WhisperAgent(object):
         if self.path_exists(self.audio_path):
             return
         
-        extract_sound_from_video(self.config.video_path, self.audio_path, format='mp3')
+        if self.audio_path.endswith('.wav'):
+            extract_pcm_from_video(self.config.video_path, self.audio_path, SAMPLE_RATE)
+        else:
+            extract_sound_from_video(self.config.video_path, self.audio_path, format='mp3')
 
     def speech_to_text(self):
         if self.path_exists(self.srt_path):
@@ -89,59 +120,29 @@ class WhisperAgent(object):
         
         if not self.model:
             with CONSOLE.status('模型加载中...'):
-                self.model = whisper.load_model(self.config.whisper_model)
+                self.model = load_model(self.config.whisper_model, self.config.daemon_socket, self.config.use_daemon, self.config.asr_backend)
 
         # 将音频读取为numpy
-        # self.audio_np = whisper.audio.load_audio(self.audio_path)
         self.prepare_audio()
 
-        # 选取长6分钟的片段
-        clip_start = 0
-        clip_end = clip_start + 6 * 60 * SAMPLE_RATE
-        clip_last_sentence = ''
-
         # 逐片段转文本
-        sa = SrtAssembler(self.config.comma_as_end_threshold)
-        while clip_end < self.audio_np.size:
-            result = self.model.transcribe(self.audio_np[clip_start:clip_end], word_timestamps=True, initial_prompt=self.config.whisper_prompt + ' ' + clip_last_sentence, task=self.config.task)
-                
-            for segment in result['segments']:
-                for word_dict in segment['words']:
-                    sa.get_next_input(word_dict, clip_start / SAMPLE_RATE)
-            
-            clip_start, clip_last_sentence = sa.get_clip_end_info(SAMPLE_RATE)
-            clip_end = clip_start + 6 * 60 * SAMPLE_RATE
-        else:
-            result = self.model.transcribe(self.audio_np[clip_start:], word_timestamps=True, initial_prompt=self.config.whisper_prompt + ' ' + clip_last_sentence, task=self.config.task)
-
-            for segment in result['segments']:
-                for word_dict in segment['words']:
-                    sa.get_next_input(word_dict, clip_start / SAMPLE_RATE)
-            
+        transcriber = Transcriber(self.model, self.config, cache=self.word_cache)
+        name = os.path.splitext(os.path.basename(self.config.video_path))[0]
+        sa = transcriber.transcribe(self.audio_np, name, checkpoint_path=self.srt_path + '.ckpt', stream_path=self.srt_path)
         sa.generate_srt(self.srt_path)
+        transcriber.finish()
     
     def translate_srt(self):
         if self.path_exists(self.bi_srt_path):
             return
 
-        subtitles = []
-        translated_subtitles = []
-        total_chara = 0
         with open(self.srt_path, 'r', encoding='utf-8') as f:
             text_lines = f.readlines()
-            for i in range(2, len(text_lines) - 1, 4):
-                subtitle = text_lines[i]
-                total_chara += len(subtitle)
-                subtitles.append(text_lines[i])
-                if total_chara > self.config.api_character_limit:
-                    translation = self.translator.translate(''.join(subtitles))
-                    translated_subtitles.extend(translation.split('\n'))
-                    subtitles = []
-                    total_chara = 0
-                    time.sleep(.2) # 等待0.2秒
-
-            translation = self.translator.translate(''.join(subtitles))
-            translated_subtitles.extend(translation.split('\n'))
+
+        subtitles = [text_lines[i].strip() for i in range(2, len(text_lines) - 1, 4)]
+        translated_subtitles = translate_unique(subtitles, self.translate_lines, self.config.api_character_limit)
+        if self.memory is not None:
+            self.memory.report()
 
         for i in range(2, len(text_lines) - 1, 4):
             if self.config.only_zh:
@@ -151,6 +152,7 @@ class WhisperAgent(object):
 
         with open(self.bi_srt_path, 'w', encoding='utf-8') as f:
             f.write(''.join(text_lines))
+        save_source_hashes(self.bi_srt_path)
 
     def path_exists(self, path):
         if os.path.exists(path):
@@ -163,9 +165,12 @@ class WhisperAgent(object):
         filename, suffix = os.path.splitext(os.path.basename(path))
         ensure_folder_exists(self.config.audio_dir)
         ensure_folder_exists(self.config.srt_dir)
+        # 优先使用已有的音频，都没有时提取
         self.audio_path = self.config.audio_dir + filename + '.m4a'
         if not self.path_exists(self.audio_path):
-            self.audio_path.replace('.m4a', '.mp3')
+            self.audio_path = self.audio_path.replace('.m4a', '.mp3')
+        if not self.path_exists(self.audio_path) and self.config.fast_extract:
+            self.audio_path = self.audio_path.replace('.mp3', '.wav')
         self.srt_path = self.config.srt_dir + filename + '_en' + self.config.subtitle_type
         self.bi_srt_path = self.config.video_path.replace('.mp4', self.config.subtitle_type)
         LOGGER.info(f'AudioPath: {self.audio_path}')
@@ -182,6 +187,9 @@ class WhisperAgent(object):
             self.extract_audio_from_video()
             LOGGER.info("提取音频完成")
         
-        self.audio_np = whisper.audio.load_audio(self.audio_path)
+        if self.audio_cache is not None:
+            self.audio_np = self.audio_cache.load(self.audio_path)
+        else:
+            self.audio_np = load_audio(self.audio_path, SAMPLE_RATE)
         
 
@@ -18,46 +18,141 @@ seg_dict
 }
 """
 
+import os
+
+
+class Cue(object):
+    """一条字幕。用__slots__存储，长音频的几十万个单词组成的字幕也不会占用太多内存"""
+    __slots__ = ('id', 'start', 'end', 'text')
+
+    def __init__(self, id, start, end, text):
+        self.id = id
+        self.start = start
+        self.end = end
+        self.text = text
+
+
+# 句末标点和可以断句的句中标点
+END_PUNCTUATION = '.?!。！？'
+SOFT_PUNCTUATION = ',:;，；：、'
+# 选择切分点时，句中标点相当于多少秒的停顿
+SOFT_PUNCTUATION_BONUS = 0.5
+# 选择切分点时，前半句超过preferred_cps的扣分，比任何停顿都大，有不超过的位置时一定不选超过的
+CPS_PENALTY = 1000.
+
+
 class SrtAssembler(object):
     """从whisper结果生成srt文件
     
     comma_as_end_threshold: 如果句子中的逗号前已经有comma_as_end_threshold个字符，则直接在这里断句
+    keep_lines: 是否在srt_lines中保留所有字幕。流式写入文件时可以关闭，内存占用不随音频长度增长
+    max_duration: 字幕的最长时长(秒)，0表示不限制
+    max_line_length: 字幕的最大字符数，0表示不限制
+    preferred_cps: 期望的每秒字符数上限，0表示不考虑。只是偏好而不是限制:
+        强制断句时优先选前半句不超过它的位置，都超过时仍按停顿选；按标点结束的字幕不受它影响
+    on_line: 每结束一句字幕就用这句字幕(Cue)调用它，用于边转文本边翻译
 
+    Whisper漏掉标点时句子会一直不结束。超过max_duration或max_line_length时，
+    在当前句子中停顿最长的单词间隙处切开(句中标点处优先)，后半部分继续等待后面的单词。
+    句子长度受这两个限制约束，所以每个单词只会被扫描常数次，总耗时与单词数成线性关系。
     """
-    def __init__(self, comma_as_end_threshold=90):
+    def __init__(self, comma_as_end_threshold=90, keep_lines=True, max_duration=0., max_line_length=0, preferred_cps=0.):
         self.srt_lines = []
         self.id = 0
-        self.line_text = ''
-        self.line_start = ''
+        # 当前句子的单词[(word, start, end), ...]，句子结束时才拼接一次
+        self.words = []
+        self.line_length = 0
         self.comma_as_end_threshold = comma_as_end_threshold
+        self.keep_lines = keep_lines
+        self.max_duration = max_duration
+        self.max_line_length = max_line_length
+        self.preferred_cps = preferred_cps
+        self.last_line: Cue = None
+        self.line_count = 0
+        self.forced_splits = 0
+        self.stream = None
+        self.stream_path = ''
+        self.on_line = None
+
+    @property
+    def line_text(self):
+        return ''.join(w[0] for w in self.words)
+
+    @property
+    def line_start(self):
+        return self.words[0][1] if self.words else ''
+
+    def discard_pending(self):
+        """丢弃还没结束的句子"""
+        self.words = []
+        self.line_length = 0
     
     def check_sentence_should_end(self, word):
-        cond_a = word[-1] in '.?!。！？'
-        cond_b = word[-1] in ',:;，；：、' and len(self.line_text) > self.comma_as_end_threshold
+        cond_a = word[-1] in END_PUNCTUATION
+        cond_b = word[-1] in SOFT_PUNCTUATION and self.line_length > self.comma_as_end_threshold
         return cond_a or cond_b
+
+    def check_sentence_too_long(self):
+        if len(self.words) < 2:
+            return False
+        if self.max_duration > 0 and self.words[-1][2] - self.words[0][1] > self.max_duration:
+            return True
+        return self.max_line_length > 0 and self.line_length > self.max_line_length
+
+    def find_split(self):
+        """返回切分位置k，前k个单词组成一句。在停顿最长处切分，同分时取靠后的位置"""
+        best_k, best_score = len(self.words) - 1, None
+        chars = 0
+        for k in range(1, len(self.words)):
+            prev_word, prev_start, prev_end = self.words[k - 1]
+            chars += len(prev_word)
+            score = self.words[k][1] - prev_end
+            if prev_word[-1] in SOFT_PUNCTUATION:
+                score += SOFT_PUNCTUATION_BONUS
+            if self.preferred_cps > 0 and chars / max(prev_end - self.words[0][1], 1e-3) > self.preferred_cps:
+                score -= CPS_PENALTY
+            if best_score is None or score >= best_score:
+                best_k, best_score = k, score
+        return best_k
      
     def get_next_input(self, word_dict, offset=0.):
         word = word_dict['word']
         start = word_dict['start'] + offset
         end = word_dict['end'] + offset
 
-        if self.line_text == '':
-            self.id += 1
-            self.line_start = start
-
-        self.line_text += word
+        self.words.append((word, start, end))
+        self.line_length += len(word)
 
         if self.check_sentence_should_end(word):
-            self.srt_lines.append({
-                'id': self.id,
-                'start': self.line_start,
-                'end': end,
-                'text': self.line_text
-            })
-            self.line_text = ''
+            self.end_line(len(self.words))
+            return
+
+        while self.check_sentence_too_long():
+            self.forced_splits += 1
+            self.end_line(self.find_split())
+
+    def end_line(self, k):
+        """前k个单词组成一句字幕，剩下的单词留给下一句"""
+        self.id += 1
+        words, self.words = self.words[:k], self.words[k:]
+        self.line_length = sum(len(w[0]) for w in self.words)
+        line = Cue(self.id, words[0][1], words[-1][2], ''.join(w[0] for w in words))
+        self.last_line = line
+        self.line_count += 1
+        if self.keep_lines:
+            self.srt_lines.append(line)
+        if self.stream is not None:
+            self.stream.write(self.format_line(line))
+        if self.on_line is not None:
+            self.on_line(line)
+
+    def flush(self):
+        """把最后没有句末标点的单词也作为一句"""
+        if self.words:
+            self.end_line(len(self.words))
     
     def get_clip_end_info(self, sr=16000):
-        return (int(self.srt_lines[-1]['end'] * sr), self.srt_lines[-1]['text'])
+        return (int(self.last_line.end * sr), self.last_line.text)
 
     def get_timeline(self, t):
         """1234.12 -> xx:xx:xx,xxx (h:m:s,ms)"""
@@ -70,14 +165,29 @@ class SrtAssembler(object):
         minutes %= 60
         return f'{hours:02d}:{minutes:02d}:{seconds:02d},{ms}'
 
+    def format_line(self, line: Cue):
+        return f'{line.id}\n{self.get_timeline(line.start)} --> {self.get_timeline(line.end)}\n{line.text.strip()}\n\n'
+
+    def open_stream(self, filepath):
+        """之后每结束一句就写入文件。先写到临时文件，generate_srt时再改名为filepath"""
+        self.stream_path = filepath + '.part'
+        self.stream = open(self.stream_path, 'w', encoding='utf-8')
+
+    def abort_stream(self):
+        """转文本失败时删除写了一半的文件"""
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+            if os.path.exists(self.stream_path):
+                os.remove(self.stream_path)
+
     def generate_srt(self, filepath):
-        srt_text = ''
-        for line in self.srt_lines:
-            srt_text += str(line['id']) + '\n'
-            srt_text += self.get_timeline(line['start']) + ' --> ' + self.get_timeline(line['end']) + '\n'
-            srt_text += line['text'].strip() + '\n'
-            srt_text += '\n'
+        self.flush()
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+            os.replace(self.stream_path, filepath)
+            return
 
         with open(filepath, 'w', encoding='utf-8') as f:
-            f.write(srt_text)
-
+            f.writelines(self.format_line(line) for line in self.srt_lines)
@@ -0,0 +1,70 @@
+"""边转文本边翻译
+
+SrtAssembler每结束一句字幕就交给StreamTranslator，后台线程攒够api_character_limit个字符就发出一个翻译请求。
+翻译与Whisper解码重叠进行，最后一个窗口解码完后只剩最后一个不满的包需要翻译。
+"""
+import queue
+import threading
+
+from srt_assembler import Cue
+from utils import LOGGER
+
+_STOP = object()
+
+
+class StreamTranslator(object):
+    """translate_lines(lines): 按顺序返回lines的译文
+    limit: 每个包的字符上限
+    """
+    def __init__(self, translate_lines, limit, name=''):
+        self.translate_lines = translate_lines
+        self.limit = limit
+        self.name = name
+        self.queue = queue.Queue()
+        # 字幕序号 -> 译文
+        self.translations = {}
+        self.packages = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, cue: Cue):
+        self.queue.put((cue.id, cue.text.strip()))
+
+    def run(self):
+        package = []
+        total_chara = 0
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            package.append(item)
+            total_chara += len(item[1]) + 1
+            if total_chara >= self.limit:
+                self.translate_package(package)
+                package = []
+                total_chara = 0
+        if package:
+            self.translate_package(package)
+
+    def translate_package(self, package):
+        if self.error is not None:
+            return
+        try:
+            translations = self.translate_lines([text for _, text in package])
+        except Exception as e:
+            # 之后由translate_srt重新翻译整个文件
+            self.error = e
+            LOGGER.error(f'{self.name} 边转文本边翻译出错: {e}')
+            return
+        self.packages += 1
+        self.translations.update((cue_id, translation) for (cue_id, _), translation in zip(package, translations))
+
+    def finish(self, count):
+        """等待剩下的句子翻译完，返回序号1~count的译文。出错或缺少译文时返回None"""
+        self.queue.put(_STOP)
+        self.thread.join()
+        if self.error is not None or any(i not in self.translations for i in range(1, count + 1)):
+            return None
+        LOGGER.debug(f'{self.name} 边转文本边翻译 {count} 句，共{self.packages}个包')
+        return [self.translations[i] for i in range(1, count + 1)]
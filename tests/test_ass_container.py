@@ -0,0 +1,24 @@
+from src.ass_container import SCRIPT_INFO, STYLES, AssContainer
+
+EVENTS = '[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n'
+
+
+def write_ass(path, dialogues):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(SCRIPT_INFO + '\n\n' + STYLES + '\n\n' + EVENTS + ''.join(dialogues))
+
+
+def test_round_trip_keeps_text_after_colon(tmp_path):
+    path = str(tmp_path / 'a.ass')
+    write_ass(path, ['Dialogue: 0,0:00:01.00,0:00:02.00,ZH,,0,0,0,,注意: 这很重要。\\N{\\rEN}Note: this is important.\n'])
+
+    container = AssContainer()
+    container.load_srt(path)
+    assert container.clips[0].source_text == '注意: 这很重要。'
+    assert container.clips[0].target_text.strip() == '{\\rEN}Note: this is important.'
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(container.export_srt())
+    reloaded = AssContainer()
+    reloaded.load_srt(path)
+    assert reloaded.clips[0].target_text.strip() == '{\\rEN}Note: this is important.'
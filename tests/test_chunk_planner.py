@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from chunk_planner import SAMPLE_RATE, plan_chunks
+
+
+def test_chunks_cover_audio_without_gaps():
+    audio_np = np.random.default_rng(0).standard_normal(100 * SAMPLE_RATE).astype(np.float32)
+    plan = plan_chunks(audio_np, target_seconds=20, search_seconds=5)
+
+    starts = [start for start, _ in plan]
+    ends = [end for _, end in plan]
+    assert starts[0] == 0 and ends[-1] == audio_np.size
+    assert starts[1:] == ends[:-1]
+    assert all(end > start for start, end in plan)
+
+
+@pytest.mark.parametrize('search_seconds', [20, 30])
+def test_search_span_not_shorter_than_chunk_is_rejected(search_seconds):
+    # 寻找范围不小于窗口长度时，切分点可能就是窗口开头，会一直循环
+    audio_np = np.zeros(100 * SAMPLE_RATE, dtype=np.float32)
+    with pytest.raises(ValueError):
+        plan_chunks(audio_np, target_seconds=20, search_seconds=search_seconds)
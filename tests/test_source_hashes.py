@@ -0,0 +1,26 @@
+from source_hashes import edited_clips, load_source_hashes, load_subtitles, save_source_hashes
+from src.srt_container import SrtContainer
+
+SRT = '1\n00:00:01,000 --> 00:00:02,000\n对\nRight.\n\n2\n00:00:03,000 --> 00:00:04,000\n好\nOkay.\n\n'
+
+
+def test_srt_content_with_ass_suffix(tmp_path):
+    # 字幕编辑器把srt格式写到.ass后缀的路径
+    path = str(tmp_path / 'a.ass')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(SRT)
+
+    assert isinstance(load_subtitles(path), SrtContainer)
+    save_source_hashes(path)
+    assert edited_clips(load_subtitles(path).clips, load_source_hashes(path)) == []
+
+
+def test_edit_to_another_cues_text_is_detected(tmp_path):
+    path = str(tmp_path / 'a.srt')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(SRT)
+    save_source_hashes(path)
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(SRT.replace('Right.', 'Okay.'))
+    assert edited_clips(load_subtitles(path).clips, load_source_hashes(path)) == [0]
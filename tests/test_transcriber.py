@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from transcriber import Transcriber
+
+SAMPLE_RATE = 16000
+
+
+def make_config(**kwargs):
+    config = dict(
+        whisper_prompt='', whisper_model='medium', whisper_lang='en', task='transcribe', src_lang='en',
+        asr_backend='whisper', chunk_strategy='sentence', chunk_seconds=30, min_chunk_seconds=10,
+        compact_speech=False, filter_hallucination=False, comma_as_end_threshold=90,
+        max_cue_duration=0., max_line_length=0, preferred_cps=0.,
+    )
+    config.update(kwargs)
+    return SimpleNamespace(**config)
+
+
+class FakeModel(object):
+    """每个窗口都输出同样的单词，时间相对于窗口开头"""
+
+    def __init__(self, words, max_calls=50):
+        self.words = words
+        self.max_calls = max_calls
+        self.windows = []
+
+    def transcribe(self, audio_np, **kwargs):
+        self.windows.append(audio_np.size)
+        assert len(self.windows) <= self.max_calls, '同一个窗口被反复解码'
+        return {'segments': [{'compression_ratio': 1., 'words': [
+            {'word': word, 'start': start, 'end': end, 'probability': 0.9} for word, start, end in self.words
+        ]}]}
+
+
+def test_sentence_ending_at_window_start_moves_forward():
+    # 唯一的一句在窗口开头结束，下一窗口的起点不能停在原地
+    model = FakeModel([('Okay.', 0., 0.)])
+    audio_np = np.zeros(100 * SAMPLE_RATE, dtype=np.float32)
+
+    sa = Transcriber(model, make_config()).transcribe(audio_np, 'test')
+
+    assert len(model.windows) <= 5
+    assert sa.srt_lines and sa.srt_lines[0].text == 'Okay.'
@@ -0,0 +1,409 @@
+from collections import Counter
+
+import numpy as np
+
+from asr_backend import model_id
+from checkpoint import WindowCheckpoint
+from chunk_planner import SAMPLE_RATE, ChunkPlan, plan_chunks
+from hallucination import normalize_word, new_filter
+from prompt_builder import PromptBuilder, whisper_language
+from speech_compactor import OffsetMap, compact_speech
+from srt_assembler import SrtAssembler
+from utils import LOGGER
+from word_cache import WordCache, audio_digest
+
+
+def stitch_words(regions):
+    """把各区域的单词流拼接为一条，时间转换为绝对时间(秒)
+
+    regions: [(own_start, own_end, decode_start, result), ...] 按时间排序，单位为采样点。
+        [own_start, own_end)是该区域负责的范围，解码时会向两侧多取一小段音频。
+        单词的开始时间决定它归哪个区域，开始时间不在负责范围内的单词丢弃。
+    两个区域对接缝处同一个单词给出的时间略有不同，可能都保留了它。
+    与上一个单词时间重叠过半，或文本相同且时间有重叠的单词视为重复，只保留先出现的。
+    """
+    words = []
+    for own_start, own_end, decode_start, result in regions:
+        offset = decode_start / SAMPLE_RATE
+        own_start /= SAMPLE_RATE
+        own_end /= SAMPLE_RATE
+        for segment in result['segments']:
+            for word_dict in segment['words']:
+                start = word_dict['start'] + offset
+                end = word_dict['end'] + offset
+                if start < own_start or start >= own_end:
+                    continue
+                if words:
+                    last = words[-1]
+                    if (start + end) / 2 < last['end']:
+                        continue
+                    if start < last['end'] and normalize_word(word_dict['word']) == normalize_word(last['word']):
+                        continue
+                words.append({**word_dict, 'start': start, 'end': end})
+    return words
+
+
+def window_source(audio_np, start, end):
+    """交给子进程的窗口。音频是float32的memmap时只传文件路径和位置，由子进程自己读取，
+    不用把所有窗口的音频都序列化传过去
+    """
+    if isinstance(audio_np, np.memmap) and audio_np.filename and audio_np.offset == 0 and audio_np.dtype == np.float32:
+        return (audio_np.filename, start, end)
+    return audio_np[start:end]
+
+
+def load_window(source):
+    """window_source的逆操作，在子进程中调用"""
+    if isinstance(source, tuple):
+        path, start, end = source
+        return np.memmap(path, dtype=np.float32, mode='r')[start:end]
+    return source
+
+
+def new_assembler(config, keep_lines=True):
+    return SrtAssembler(
+        config.comma_as_end_threshold, keep_lines,
+        config.max_cue_duration, config.max_line_length, config.preferred_cps
+    )
+
+
+def resegment(regions, config, speech_spans=None):
+    """用缓存的单词流重新断句，不需要再运行模型
+
+    speech_spans: 转文本时去掉了静音的话，需要提供保留的语音区间，把时间映射回原音频
+    """
+    hallucination = new_filter(config)
+    if hallucination is not None:
+        regions = [(*region[:3], hallucination.filter(region[3])[0]) for region in regions]
+    offset_map = OffsetMap(speech_spans) if speech_spans else None
+    sa = new_assembler(config)
+    for word_dict in stitch_words(regions):
+        if offset_map is not None:
+            start, end = offset_map.map_word(word_dict['start'], word_dict['end'])
+            word_dict = {**word_dict, 'start': start, 'end': end}
+        sa.get_next_input(word_dict)
+    return sa
+
+
+class Transcriber(object):
+    """逐窗口调用模型转文本，结果交给SrtAssembler组装
+
+    chunk_strategy:
+        silence: 在目标长度附近的静音处预先切好窗口，每段音频只解码一次
+        sentence: 每个窗口从上一窗口最后一个完整句子的结尾重新开始，句子后的音频会被解码两次
+    """
+    def __init__(self, model, config, on_progress=None, cache: WordCache = None, on_line=None):
+        self.model = model
+        self.config = config
+        self.on_progress = on_progress
+        # 传给SrtAssembler，每结束一句字幕调用一次
+        self.on_line = on_line
+        self.checkpoint: WindowCheckpoint = None
+        self.cache = cache
+        self.audio_hash = ''
+        # (start, end) -> 缓存键
+        self.keys = {}
+        self.stream_path = None
+        # 当前使用的SrtAssembler，出错时删除它写了一半的字幕
+        self.assembler: SrtAssembler = None
+        self.prompt_builder = PromptBuilder(config.whisper_prompt, config.whisper_model)
+        # 识别语言。需要检测时由第一个实际解码的窗口检测，之后的窗口沿用
+        self.language = whisper_language(config)
+        self.hallucination = new_filter(config)
+        # 最近一次decode中被标记为幻觉的区间(绝对采样点)
+        self.last_flagged = []
+        # 去掉静音后，窗口位置都是压缩后音频中的位置，单词时间交给SrtAssembler前才映射回原音频
+        self.offset_map: OffsetMap = None
+
+    def new_assembler(self):
+        """流式写入时字幕一结束就写入文件，不在内存中保留"""
+        sa = new_assembler(self.config, keep_lines=self.stream_path is None)
+        if self.stream_path is not None:
+            sa.open_stream(self.stream_path)
+        sa.on_line = self.on_line
+        self.assembler = sa
+        return sa
+
+    def open_checkpoint(self, path, audio_np):
+        """每个窗口完成后写入断点，参数不变时重新运行会跳过已完成的窗口"""
+        self.checkpoint = WindowCheckpoint(path, {
+            'samples': int(audio_np.size),
+            'model': model_id(self.config.asr_backend, self.config.whisper_model),
+            'task': self.config.task,
+            'prompt': self.config.whisper_prompt,
+            'language': whisper_language(self.config),
+            'chunk_strategy': self.config.chunk_strategy,
+            'speech_spans': self.offset_map.spans if self.offset_map is not None else None,
+        })
+
+    def finish(self):
+        """字幕文件写入后调用，删除断点"""
+        if self.checkpoint is not None:
+            self.checkpoint.remove()
+            self.checkpoint = None
+
+    def transcribe_window(self, audio_np, prompt, language=None):
+        """prompt: 已由PromptBuilder拼接好的完整prompt"""
+        return self.model.transcribe(
+            audio_np, word_timestamps=True, initial_prompt=prompt,
+            task=self.config.task, language=language or self.language
+        )
+
+    def detect_language(self, result):
+        if self.language is None and result.get('language'):
+            self.language = result['language']
+            LOGGER.info(f'检测到语言: {self.language}')
+
+    def lookup(self, clip_start, clip_end, prompt):
+        """依次在断点和单词缓存中查找窗口的结果，都没有时返回None"""
+        if self.cache is not None:
+            self.keys[(clip_start, clip_end)] = self.cache.key(
+                self.audio_hash, model_id(self.config.asr_backend, self.config.whisper_model),
+                f'{self.config.task}:{whisper_language(self.config)}', prompt, clip_start, clip_end
+            )
+
+        result = None
+        if self.checkpoint is not None:
+            result = self.checkpoint.get(clip_start, clip_end)
+        if result is None and self.cache is not None:
+            result = self.cache.get(self.keys[(clip_start, clip_end)])
+            if result is not None and self.checkpoint is not None:
+                self.checkpoint.save(clip_start, clip_end, result)
+        return result
+
+    def store(self, clip_start, clip_end, result):
+        if self.checkpoint is not None:
+            self.checkpoint.save(clip_start, clip_end, result)
+        if self.cache is not None:
+            self.cache.put(self.keys[(clip_start, clip_end)], result)
+
+    def decode(self, audio_np, clip_start, clip_end, context):
+        """转写audio_np[clip_start:clip_end]。断点或缓存中已有的窗口直接返回记录的结果
+
+        context: 上一句或标题，与whisper_prompt一起按token预算拼成prompt
+        """
+        prompt = self.prompt_builder.build(context)
+        result = self.lookup(clip_start, clip_end, prompt)
+        if result is None:
+            result = self.transcribe_window(audio_np[clip_start:clip_end], prompt)
+            self.detect_language(result)
+            self.store(clip_start, clip_end, result)
+        # 缓存中保存原始结果，修改过滤参数后不需要重新转文本
+        return self.clean(result, clip_start)
+
+    def clean(self, result, clip_start):
+        """去掉幻觉单词，被标记的区间记录在last_flagged中"""
+        self.last_flagged = []
+        if self.hallucination is None:
+            return result
+        result, flagged = self.hallucination.filter(result)
+        self.last_flagged = [(clip_start + int(start * SAMPLE_RATE), clip_start + int(end * SAMPLE_RATE)) for start, end in flagged]
+        return result
+
+    def save_manifest(self, name, regions):
+        """regions: [(own_start, own_end, decode_start, decode_end), ...]"""
+        if self.cache is None:
+            return
+        self.cache.save_manifest(name, self.audio_hash, [
+            (own_start, own_end, decode_start, self.keys[(decode_start, decode_end)])
+            for own_start, own_end, decode_start, decode_end in regions
+        ], self.offset_map.spans if self.offset_map is not None else None)
+
+    def emit(self, sa: SrtAssembler, word_dict, offset=0.):
+        if self.offset_map is None:
+            sa.get_next_input(word_dict, offset)
+            return
+        start, end = self.offset_map.map_word(word_dict['start'] + offset, word_dict['end'] + offset)
+        sa.get_next_input({**word_dict, 'start': start, 'end': end})
+
+    def feed(self, sa: SrtAssembler, result, clip_start):
+        for segment in result['segments']:
+            for word_dict in segment['words']:
+                self.emit(sa, word_dict, clip_start / SAMPLE_RATE)
+
+    def clip_end_info(self, sa: SrtAssembler):
+        """最后一句的结尾在(压缩后)音频中的采样点位置和文本"""
+        if self.offset_map is None:
+            return sa.get_clip_end_info(SAMPLE_RATE)
+        return int(self.offset_map.to_compact(sa.last_line.end) * SAMPLE_RATE), sa.last_line.text
+
+    def end_line_before(self, sa: SrtAssembler, sample):
+        """未结束的半句中，在sample(压缩后音频的采样点)之前开始的单词作为一句，之后的单词留在半句中"""
+        t = sample / SAMPLE_RATE
+        if self.offset_map is not None:
+            t = self.offset_map.to_original(t)
+        k = sum(1 for _, start, _ in sa.words if start < t)
+        if k:
+            sa.end_line(k)
+
+    def progress(self, fraction):
+        if self.on_progress is not None:
+            self.on_progress(fraction)
+
+    def transcribe(self, audio_np, name='', title='', map_windows=None, checkpoint_path=None, stream_path=None):
+        """返回SrtAssembler。转文本出错或被中断时删除写了一半的字幕后重新抛出异常，断点保留，重新运行时继续
+
+        title: 第一个窗口没有上一句可用时，作为prompt的补充
+        map_windows: 提供时各区域并行转文本，见transcribe_parallel
+        checkpoint_path: 断点文件路径。写入字幕文件后需调用finish删除断点
+        stream_path: 字幕边生成边写入该路径，需调用SrtAssembler.generate_srt(stream_path)完成写入
+        """
+        self.stream_path = stream_path
+        self.offset_map = None
+        if self.config.compact_speech:
+            audio_np, self.offset_map = compact_speech(audio_np, self.config.min_silence_seconds, self.config.silence_threshold_db, name)
+        if checkpoint_path is not None:
+            self.open_checkpoint(checkpoint_path, audio_np)
+        if self.cache is not None:
+            self.audio_hash = audio_digest(audio_np)
+
+        try:
+            if map_windows is not None:
+                sa, plan, regions = self.transcribe_parallel(audio_np, map_windows, title)
+            elif self.config.chunk_strategy == 'sentence':
+                sa, plan, regions = self.transcribe_by_sentence(audio_np, name, title)
+            else:
+                sa, plan, regions = self.transcribe_by_silence(audio_np, title)
+        except BaseException:
+            if self.assembler is not None:
+                self.assembler.abort_stream()
+            raise
+        plan.report(name)
+        if self.hallucination is not None:
+            self.hallucination.report(name)
+
+        self.save_manifest(name, regions)
+        return sa
+
+    def transcribe_by_silence(self, audio_np, title=''):
+        plan = plan_chunks(audio_np, self.config.chunk_seconds, self.config.chunk_search_seconds)
+        sa = self.new_assembler()
+        for clip_start, clip_end in plan:
+            # 窗口边界在静音处，未结束的句子直接延续到下一窗口
+            prompt = sa.last_line.text if sa.last_line is not None else title
+            result = self.decode(audio_np, clip_start, clip_end, prompt)
+            self.feed(sa, result, clip_start)
+            self.progress(clip_end / audio_np.size)
+        return sa, plan, [(start, end, start, end) for start, end in plan]
+
+    def transcribe_parallel(self, audio_np, map_windows, title=''):
+        """把音频切成以静音分隔的独立区域，由map_windows并行转文本，再拼接回一个SrtAssembler
+
+        map_windows(windows, prompts, languages): 按顺序返回每个窗口的转文本结果，通常是进程池的map。
+            windows是window_source的生成器，子进程用load_window取得音频
+        各区域互不依赖，因此prompt中没有上一句，只有title
+        需要检测语言时，先单独解码第一个窗口，其余窗口使用检测出的语言
+        """
+        regions = plan_chunks(audio_np, self.config.chunk_seconds, self.config.chunk_search_seconds)
+        padding = int(self.config.region_padding * SAMPLE_RATE)
+        plan = ChunkPlan(audio_np.size)
+        for own_start, own_end in regions:
+            plan.add(max(0, own_start - padding), min(audio_np.size, own_end + padding))
+
+        prompt = self.prompt_builder.build(title)
+        results = [self.lookup(start, end, prompt) for start, end in plan]
+        todo = [i for i, result in enumerate(results) if result is None]
+        batches = [todo[:1], todo[1:]] if self.language is None else [todo]
+        done = len(results) - len(todo)
+        for batch in batches:
+            windows = (window_source(audio_np, *plan.chunks[i]) for i in batch)
+            for i, result in zip(batch, map_windows(windows, [prompt] * len(batch), [self.language] * len(batch))):
+                results[i] = result
+                self.detect_language(result)
+                self.store(*plan.chunks[i], result)
+                done += 1
+                self.progress(done / len(results))
+
+        stitched = [(*regions.chunks[i], plan.chunks[i][0], self.clean(result, plan.chunks[i][0])) for i, result in enumerate(results)]
+
+        sa = self.new_assembler()
+        for word_dict in stitch_words(stitched):
+            self.emit(sa, word_dict)
+        return sa, plan, [(*regions.chunks[i], *plan.chunks[i]) for i in range(len(plan))]
+
+    def transcribe_by_sentence(self, audio_np, name='', title=''):
+        base_length = int(self.config.chunk_seconds * SAMPLE_RATE)
+        min_length = int(self.config.min_chunk_seconds * SAMPLE_RATE)
+        segment_length = base_length
+        plan = ChunkPlan(audio_np.size)
+        clip_start = 0
+        clip_end = clip_start + segment_length
+        clip_last_sentence = title
+        # 每个窗口最终用哪种方式确定了下一个窗口的起点
+        strategies = Counter()
+
+        sa = self.new_assembler()
+        while clip_end < audio_np.size:
+            result = self.decode(audio_np, clip_start, clip_end, clip_last_sentence)
+            plan.add(clip_start, clip_end)
+            line_count = sa.line_count
+            self.feed(sa, result, clip_start)
+
+            if sa.line_count > line_count:
+                strategy = 'sentence'
+            elif len(sa.words) >= 2:
+                # 输出没有标点导致的。在已解码单词的最大停顿处强制断句，不用重新解码
+                sa.end_line(sa.find_split())
+                strategy = 'gap_split'
+            elif sa.words:
+                # 只有一个单词，直接作为一句
+                sa.flush()
+                strategy = 'flush'
+            elif self.last_flagged:
+                # 输出全是幻觉，说明这里没有正常的语音，不用缩短窗口重试
+                strategy = 'hallucination'
+                if segment_length == base_length and min_length < base_length:
+                    self.hallucination.saved_seconds += max(min_length, base_length // 2) / SAMPLE_RATE
+            elif segment_length == base_length and min_length < base_length:
+                # 没有任何输出，可能是解码失败，缩短窗口重试一次
+                strategies['shorter'] += 1
+                segment_length = max(min_length, base_length // 2)
+                clip_end = clip_start + segment_length
+                LOGGER.warn(f"{name} {clip_start / SAMPLE_RATE:.1f}s处的窗口没有输出，缩短为{segment_length / SAMPLE_RATE:.0f}s重试")
+                continue
+            else:
+                strategy = 'skip'
+            strategies[strategy] += 1
+            if strategy != 'sentence':
+                LOGGER.warn(f"{name} {clip_start / SAMPLE_RATE:.1f}s处的窗口没有断句，使用{strategy}")
+
+            if strategy == 'skip':
+                # 原窗口和缩短的窗口都没有输出，认为原窗口中没有语音
+                new_clip_start = clip_start + base_length
+            elif strategy == 'hallucination':
+                new_clip_start = self.last_flagged[-1][1]
+            else:
+                new_clip_start, clip_last_sentence = self.clip_end_info(sa)
+                # 最后一句之后是幻觉时，下一窗口从幻觉区间之后开始，不再重新解码这段音频。
+                # 句子结尾和幻觉之间的单词不会再被解码，先作为一句保留下来
+                if self.last_flagged and self.last_flagged[-1][1] > new_clip_start:
+                    self.end_line_before(sa, self.last_flagged[-1][0])
+                    clip_last_sentence = sa.last_line.text
+                    self.hallucination.saved_seconds += (self.last_flagged[-1][1] - new_clip_start) / SAMPLE_RATE
+                    new_clip_start = self.last_flagged[-1][1]
+            if new_clip_start <= clip_start:
+                # 最后一句在窗口开头就结束了，从这里重新开始会一直解码同一个窗口。
+                # 剩下的单词都作为一句，仍然没有前进时跳过这个窗口
+                strategies['no_progress'] += 1
+                LOGGER.warn(f"{name} {clip_start / SAMPLE_RATE:.1f}s处的窗口没有前进，强制断句")
+                sa.flush()
+                if sa.last_line is not None:
+                    new_clip_start, clip_last_sentence = self.clip_end_info(sa)
+                if new_clip_start <= clip_start:
+                    new_clip_start = clip_start + base_length
+            # 最后一个句子之后的音频会在下一窗口重新解码，丢弃这里未完成的半句
+            sa.discard_pending()
+            segment_length = base_length
+            clip_start = new_clip_start
+            clip_end = clip_start + segment_length
+            self.progress(clip_start / audio_np.size)
+        else:
+            result = self.decode(audio_np, clip_start, audio_np.size, clip_last_sentence)
+            plan.add(clip_start, audio_np.size)
+            self.feed(sa, result, clip_start)
+            self.progress(1.)
+
+        LOGGER.info(f"{name} 窗口断句方式: {dict(strategies)}")
+        # 每个窗口只负责到下一窗口的开始处，之后的单词在下一窗口重新解码
+        starts = [start for start, _ in plan] + [audio_np.size]
+        return sa, plan, [(start, starts[i + 1], start, end) for i, (start, end) in enumerate(plan)]
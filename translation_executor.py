@@ -0,0 +1,98 @@
+"""并发翻译
+
+多个打包好的请求同时发出，每个翻译后端用一个令牌桶限制请求速率，
+失败的请求按指数退避加随机抖动重试，结果按提交顺序返回。
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import LOGGER
+
+
+class TokenBucket(object):
+    """每秒补充rate个令牌，最多存capacity个。每个请求消耗一个令牌，没有令牌时等待"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# 同一进程中同一个翻译后端的所有请求共用一个令牌桶，同时翻译多个文件时也不会超出配额
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def get_bucket(backend, rate, capacity):
+    with _buckets_lock:
+        if backend not in _buckets:
+            _buckets[backend] = TokenBucket(rate, capacity)
+        return _buckets[backend]
+
+
+class TranslationExecutor(object):
+    """new_translator: 创建翻译器的函数。deep_translator的翻译器不是线程安全的，每个线程各用一个
+    target: 目标语言，翻译记忆按它区分不同语言的译文
+    """
+
+    def __init__(self, new_translator, backend, workers=4, requests_per_second=2., burst=4,
+                 max_retries=5, base_delay=1., max_delay=30., target=''):
+        self.new_translator = new_translator
+        self.backend = backend
+        self.target = target
+        self.workers = max(1, workers)
+        self.bucket = get_bucket(backend, requests_per_second, burst)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    @property
+    def translator(self):
+        if not hasattr(self.local, 'translator'):
+            self.local.translator = self.new_translator()
+        return self.local.translator
+
+    def translate(self, text):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            with self.lock:
+                self.requests += 1
+            try:
+                return self.translator.translate(text)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.retries += 1
+                # full jitter: 在[0, 退避时间]内随机等待，避免多个线程同时重试
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                LOGGER.warn(f'{self.backend}翻译请求失败({e})，{delay:.1f}s后第{attempt + 1}次重试')
+                time.sleep(delay)
+
+    def map(self, func, items):
+        """并发执行func(item)，按items的顺序返回结果"""
+        items = list(items)
+        if self.workers == 1 or len(items) <= 1:
+            return [func(item) for item in items]
+        with ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(func, items))
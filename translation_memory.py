@@ -0,0 +1,94 @@
+"""翻译记忆
+
+把翻译过的句子存入SQLite，键为(翻译后端, 源语言, 目标语言, 规范化后的原文)。
+重新生成双语字幕或在编辑器中重复翻译同一句时直接使用记录的译文，不再调用翻译api。
+命令行和字幕编辑器共用同一个数据库。
+"""
+import os
+import sqlite3
+import threading
+
+from utils import LOGGER, ensure_folder_exists
+
+
+def normalize_text(text):
+    """合并空白字符。大小写和标点会影响翻译，保持不变"""
+    return ' '.join(text.split())
+
+
+class TranslationMemory(object):
+
+    def __init__(self, cache_dir):
+        ensure_folder_exists(cache_dir)
+        self.path = os.path.join(cache_dir, 'translation_memory.db')
+        # 流水线的多个翻译线程共用一个连接
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            # WAL模式下命令行和编辑器可以同时读写
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute(
+                'CREATE TABLE IF NOT EXISTS memory ('
+                'backend TEXT, src TEXT, tgt TEXT, source TEXT, translation TEXT, '
+                'PRIMARY KEY (backend, src, tgt, source)) WITHOUT ROWID'
+            )
+        self.hits = 0
+        self.misses = 0
+        self.saved_characters = 0
+
+    def get_many(self, backend, src, tgt, texts):
+        """texts: 规范化后的原文。返回{原文: 译文}，只包含记录过的句子"""
+        found = {}
+        texts = list(texts)
+        with self.lock:
+            # SQLite一条语句中的参数个数有上限，分批查询
+            for i in range(0, len(texts), 500):
+                batch = texts[i:i + 500]
+                rows = self.conn.execute(
+                    f'SELECT source, translation FROM memory WHERE backend=? AND src=? AND tgt=? '
+                    f'AND source IN ({",".join("?" * len(batch))})',
+                    (backend, src, tgt, *batch)
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, backend, src, tgt, pairs):
+        """pairs: [(规范化后的原文, 译文), ...]"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?, ?)',
+                [(backend, src, tgt, source, translation) for source, translation in pairs]
+            )
+
+    def get(self, backend, src, tgt, text):
+        return self.get_many(backend, src, tgt, [normalize_text(text)]).get(normalize_text(text))
+
+    def translate(self, backend, src, tgt, lines, translate_batch):
+        """按顺序返回lines的译文，只把记忆中没有的句子交给translate_batch
+
+        translate_batch(texts): 按顺序返回texts的译文列表
+        """
+        keys = [normalize_text(line) for line in lines]
+        found = self.get_many(backend, src, tgt, {key for key in keys if key})
+        missing = list(dict.fromkeys(key for key in keys if key and key not in found))
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key and key not in found)
+        self.saved_characters += sum(len(key) for key in keys if key in found)
+
+        if missing:
+            translations = translate_batch(missing)
+            if len(translations) != len(missing):
+                LOGGER.warn(f'译文行数({len(translations)})与原文行数({len(missing)})不一致，本次结果不存入翻译记忆')
+            else:
+                pairs = [(key, translation.strip()) for key, translation in zip(missing, translations)]
+                self.put_many(backend, src, tgt, pairs)
+            found.update((key, translation.strip()) for key, translation in zip(missing, translations))
+
+        return [found.get(key, '') for key in keys]
+
+    def report(self):
+        total = self.hits + self.misses
+        if total == 0:
+            return
+        LOGGER.info(f'翻译记忆命中 {self.hits} / {total} 句({self.hits / total:.1%})，少发送 {self.saved_characters} 个字符')
@@ -0,0 +1,109 @@
+"""翻译后端
+
+所有后端的translate都接收一段文本(可以是多行)，返回译文。
+    supports_batch: 是否可以把多行字幕打包到一次请求中。不支持时逐行翻译
+    max_payload: 单次请求的字符上限，打包时取它和api_character_limit中较小的一个
+
+    google: deep_translator的GoogleTranslator
+    baidu: deep_translator的BaiduTranslator，需要appid和appkey
+    local: 本地的翻译替身服务(local_translate_server.py)，不联网测试打包、并发和重试
+    local-line: 同一个替身服务，但每次只发送一行，测试不支持打包的后端。服务端用--single-line拒绝多行请求
+"""
+import json
+import urllib.request
+
+from utils import LOGGER
+
+
+class TranslatorBackend(object):
+    name = ''
+    supports_batch = True
+    max_payload = 5000
+
+    def translate(self, text):
+        raise NotImplementedError
+
+
+class GoogleBackend(TranslatorBackend):
+    name = 'google'
+    max_payload = 5000
+
+    def __init__(self, source, target, **kwargs):
+        from deep_translator import GoogleTranslator
+        # Google翻译的简体中文代码是zh-CN
+        if target == 'zh':
+            target = 'zh-CN'
+        self.translator = GoogleTranslator(source=source, target=target)
+
+    def translate(self, text):
+        return self.translator.translate(text)
+
+
+class BaiduBackend(TranslatorBackend):
+    name = 'baidu'
+    max_payload = 6000
+
+    def __init__(self, source, target, appid='', appkey='', **kwargs):
+        from deep_translator import BaiduTranslator
+        self.translator = BaiduTranslator(source=source, target=target, appid=appid, appkey=appkey)
+
+    def translate(self, text):
+        return self.translator.translate(text)
+
+
+class LocalBackend(TranslatorBackend):
+    name = 'local'
+    max_payload = 5000
+
+    def __init__(self, source, target, url='http://127.0.0.1:8765', timeout=30, **kwargs):
+        self.source = source
+        self.target = target
+        self.url = url.rstrip('/') + '/translate'
+        self.timeout = timeout
+
+    def translate(self, text):
+        data = json.dumps({'text': text, 'source': self.source, 'target': self.target}).encode('utf-8')
+        request = urllib.request.Request(self.url, data, {'Content-Type': 'application/json'})
+        # 429、500等错误以HTTPError抛出，由TranslationExecutor重试
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))['translation']
+
+
+class LocalLineBackend(LocalBackend):
+    name = 'local-line'
+    supports_batch = False
+
+
+TRANSLATORS = {
+    GoogleBackend.name: GoogleBackend,
+    BaiduBackend.name: BaiduBackend,
+    LocalBackend.name: LocalBackend,
+    LocalLineBackend.name: LocalLineBackend,
+}
+
+
+def get_translator_class(backend):
+    if backend not in TRANSLATORS:
+        raise ValueError(f'不支持的翻译后端 {backend}，可选: {" | ".join(TRANSLATORS)}')
+    return TRANSLATORS[backend]
+
+
+def translator_name(config):
+    """use_baidu_api保留兼容，开启时优先使用百度。后端名称不合法时抛出ValueError"""
+    name = BaiduBackend.name if config.use_baidu_api else config.translator
+    get_translator_class(name)
+    return name
+
+
+def payload_limit(backend, api_character_limit):
+    """打包翻译的字符上限。后端不支持打包时返回0，逐行翻译"""
+    translator = get_translator_class(backend)
+    if not translator.supports_batch:
+        return 0
+    return min(api_character_limit, translator.max_payload)
+
+
+def load_translator(backend, source, target, **kwargs):
+    translator = get_translator_class(backend)
+    LOGGER.debug(f'创建{backend}翻译器 {source} -> {target}')
+    return translator(source, target, **kwargs)
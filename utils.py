@@ -1,7 +1,12 @@
 import logging
 import os
+import subprocess
+import time
+import wave
 
+import numpy as np
 from pydub import AudioSegment
+from pydub.utils import mediainfo
 from rich.logging import RichHandler
 from rich.traceback import install
 
@@ -52,6 +57,102 @@ def extract_sound_from_video(video_path, sound_save_path, format='wav'):
     AudioSegment.from_file(video_path).export(sound_save_path, format=format)
 
 
+def ffmpeg_pcm_stream(path, sr=16000):
+    """启动ffmpeg，把文件的音轨解码为sr采样率的单声道16bit PCM，从stdout流式输出"""
+    cmd = [
+        'ffmpeg', '-nostdin', '-loglevel', 'error', '-i', path,
+        '-vn', '-ac', '1', '-ar', str(sr), '-f', 's16le', '-acodec', 'pcm_s16le', '-'
+    ]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def check_ffmpeg_exit(process, path):
+    process.stdout.close()
+    if process.wait() != 0:
+        raise RuntimeError(f'ffmpeg解码失败 {path}: {process.stderr.read().decode(errors="ignore")}')
+
+
+# 从视频文件直接提取16kHz单声道wav，只解码一次，没有mp3的有损转码
+def extract_pcm_from_video(video_path, wav_path, sr=16000, chunk_size=1 << 20):
+    process = ffmpeg_pcm_stream(video_path, sr)
+    total_bytes = 0
+    decode_seconds = 0.
+    write_seconds = 0.
+    with wave.open(wav_path + '.tmp', 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        while True:
+            t0 = time.time()
+            chunk = process.stdout.read(chunk_size)
+            t1 = time.time()
+            decode_seconds += t1 - t0
+            if not chunk:
+                break
+            w.writeframes(chunk)
+            write_seconds += time.time() - t1
+            total_bytes += len(chunk)
+    check_ffmpeg_exit(process, video_path)
+    os.replace(wav_path + '.tmp', wav_path)
+
+    LOGGER.info(
+        f'{os.path.basename(wav_path)}: PCM {total_bytes / 1024**2:.1f}MB ({total_bytes / 2 / sr:.1f}s音频)，'
+        f'解码 {decode_seconds:.2f}s，写入 {write_seconds:.2f}s'
+    )
+
+
+def is_pcm_wav(path, sr=16000):
+    """是否是可以直接读取的sr采样率单声道16bit wav"""
+    if not path.endswith('.wav'):
+        return False
+    try:
+        with wave.open(path, 'rb') as w:
+            return w.getnchannels() == 1 and w.getsampwidth() == 2 and w.getframerate() == sr
+    except (wave.Error, EOFError):
+        return False
+
+
+# 读取音频为float32数组，与whisper.audio.load_audio结果一致
+# 16kHz单声道wav直接读取不经过ffmpeg，其他格式由ffmpeg流式解码。按块转换，不额外保留整段的字节数据
+def load_audio(path, sr=16000, chunk_size=1 << 20):
+    t0 = time.time()
+    if is_pcm_wav(path, sr):
+        with wave.open(path, 'rb') as w:
+            audio_np = np.empty(w.getnframes(), dtype=np.float32)
+            filled = 0
+            while filled < audio_np.size:
+                chunk = np.frombuffer(w.readframes(chunk_size // 2), dtype=np.int16)
+                if chunk.size == 0:
+                    break
+                audio_np[filled:filled + chunk.size] = chunk / 32768.0
+                filled += chunk.size
+        source = 'wav'
+    else:
+        # 按时长预先分配，时长不准时再扩容
+        audio_np = np.empty(int(get_audio_duration(path) * sr) + sr, dtype=np.float32)
+        filled = 0
+        process = ffmpeg_pcm_stream(path, sr)
+        while True:
+            chunk = process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            chunk = np.frombuffer(chunk, dtype=np.int16)
+            if filled + chunk.size > audio_np.size:
+                audio_np = np.resize(audio_np, max(audio_np.size * 2, filled + chunk.size))
+            audio_np[filled:filled + chunk.size] = chunk / 32768.0
+            filled += chunk.size
+        check_ffmpeg_exit(process, path)
+        source = 'ffmpeg'
+
+    LOGGER.debug(f'{os.path.basename(path)} 读取音频({source}) {filled / sr:.1f}s，耗时 {time.time() - t0:.2f}s')
+    return audio_np[:filled]
+
+
+# 用ffprobe读取音视频时长(秒)，不解码音频
+def get_audio_duration(path):
+    return float(mediainfo(path).get('duration', 0.))
+
+
 def generate_srt(result, srt_path):
     srt_assembler = SrtAssembler()
 
@@ -0,0 +1,170 @@
+"""常驻的Whisper转文本服务
+
+模型只在服务启动时加载一次，app.py和字幕编辑器检测到服务在运行时自动通过Unix socket调用它，
+省去每次运行都要花几十秒加载模型。
+
+消息格式: 4字节大端整数表示头部长度 + json头部 + 头部中payload_bytes指定长度的原始数据
+    请求: {"cmd": "transcribe", "backend": 后端, "model": 模型名, "options": transcribe的参数, "payload_bytes": n} + float32音频
+          {"cmd": "ping"}
+    响应: {"ok": true, "result": 转文本结果} 或 {"ok": false, "error": 错误信息}
+"""
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+import tyro
+
+from asr_backend import load_backend
+from utils import LOGGER
+
+DEFAULT_SOCKET = 'assets/cache/whisper.sock'
+
+
+def send_message(sock, header: dict, payload=b''):
+    header = dict(header, payload_bytes=len(payload))
+    # whisper结果中可能有numpy的数值类型
+    raw = json.dumps(header, ensure_ascii=False, default=lambda o: o.item() if hasattr(o, 'item') else str(o)).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(raw)) + raw)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise ConnectionError('连接已关闭')
+        received += n
+    return bytes(buf)
+
+
+def recv_message(sock):
+    size, = struct.unpack('>I', recv_exact(sock, 4))
+    header = json.loads(recv_exact(sock, size).decode('utf-8'))
+    payload = recv_exact(sock, header['payload_bytes']) if header.get('payload_bytes') else b''
+    return header, payload
+
+
+def daemon_available(socket_path, timeout=0.5):
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(socket_path):
+        return False
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            send_message(sock, {'cmd': 'ping'})
+            header, _ = recv_message(sock)
+            return header.get('ok', False)
+    except OSError:
+        return False
+
+
+class RemoteModel(object):
+    """守护进程中模型的代理，transcribe的用法与whisper模型相同"""
+
+    def __init__(self, socket_path, model_name, backend='whisper'):
+        self.socket_path = socket_path
+        self.model_name = model_name
+        self.backend = backend
+
+    def transcribe(self, audio, **options):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(self.socket_path)
+            send_message(sock, {'cmd': 'transcribe', 'backend': self.backend, 'model': self.model_name, 'options': options}, audio.tobytes())
+            header, _ = recv_message(sock)
+        if not header.get('ok'):
+            raise RuntimeError(f'转文本服务出错: {header.get("error")}')
+        return header['result']
+
+
+def load_model(model_name, socket_path='', use_daemon=True, backend='whisper', **kwargs):
+    """转文本服务在运行时返回它的代理，否则在当前进程加载模型"""
+    if use_daemon and socket_path and daemon_available(socket_path):
+        LOGGER.info(f'使用转文本服务 {socket_path}')
+        return RemoteModel(socket_path, model_name, backend)
+
+    return load_backend(backend, model_name, **kwargs)
+
+
+class TranscribeHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            header, payload = recv_message(self.request)
+            if header['cmd'] == 'ping':
+                send_message(self.request, {'ok': True, 'models': [f'{b}:{m}' for b, m in self.server.models]})
+                return
+
+            audio = np.frombuffer(payload, dtype=np.float32)
+            t0 = time.time()
+            # 模型同时只处理一个请求
+            with self.server.lock:
+                model = self.server.get_model(header.get('backend', 'whisper'), header['model'])
+                result = model.transcribe(audio, **header.get('options', {}))
+            LOGGER.info(f'转文本 {audio.size / 16000:.1f}s 音频，耗时 {time.time() - t0:.1f}s')
+            send_message(self.request, {'ok': True, 'result': result})
+        except Exception as e:
+            LOGGER.error(f'处理请求出错: {e}')
+            try:
+                send_message(self.request, {'ok': False, 'error': str(e)})
+            except OSError:
+                pass
+
+
+class TranscribeServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, models, backend='whisper'):
+        self.models = {}
+        self.lock = threading.Lock()
+        for name in models:
+            self.get_model(backend, name)
+        super().__init__(socket_path, TranscribeHandler)
+
+    def get_model(self, backend, name):
+        if (backend, name) not in self.models:
+            LOGGER.info(f'加载{backend}模型 {name}...')
+            self.models[(backend, name)] = load_backend(backend, name)
+        return self.models[(backend, name)]
+
+
+@dataclass
+class DaemonConfig:
+    """启动常驻的Whisper转文本服务"""
+
+    # Unix socket路径，需要与app.py和编辑器的daemon_socket一致
+    socket_path: str = DEFAULT_SOCKET
+    # 启动时预先加载的模型，其他模型在第一次请求时加载并常驻
+    models: Tuple[str, ...] = ('medium',)
+    # 预先加载的模型所用的后端 whisper | ctranslate2
+    backend: str = 'whisper'
+
+
+if __name__ == '__main__':
+    args = tyro.cli(DaemonConfig)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        LOGGER.error('当前系统不支持Unix socket')
+        exit()
+    os.makedirs(os.path.dirname(args.socket_path) or '.', exist_ok=True)
+    if os.path.exists(args.socket_path):
+        os.remove(args.socket_path)
+
+    server = TranscribeServer(args.socket_path, args.models, args.backend)
+    LOGGER.info(f'转文本服务已启动 {args.socket_path}')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        os.remove(args.socket_path)
@@ -0,0 +1,82 @@
+import gzip
+import hashlib
+import json
+import os
+
+from checkpoint import compact_result, expand_result
+from utils import LOGGER, ensure_folder_exists
+
+
+def audio_digest(audio_np):
+    """音频内容的哈希，与文件名和容器格式无关"""
+    return hashlib.blake2b(memoryview(audio_np).cast('B'), digest_size=16).hexdigest()
+
+
+class WordCache(object):
+    """Whisper单词级结果的磁盘缓存
+
+    每个窗口的结果以 音频哈希+模型+任务+prompt+窗口位置 为键，存为gzip压缩的json。
+    另外为每个文件保存一份清单，记录它由哪些窗口拼成，修改断句参数后可以直接从缓存重新生成字幕，不用再跑Whisper。
+    """
+    def __init__(self, cache_dir):
+        self.words_dir = os.path.join(cache_dir, 'words')
+        self.manifest_dir = os.path.join(cache_dir, 'manifest')
+        ensure_folder_exists(self.words_dir)
+        ensure_folder_exists(self.manifest_dir)
+
+    @staticmethod
+    def key(audio_hash, model, task, prompt, start, end):
+        raw = json.dumps([audio_hash, model, task, prompt, start, end], ensure_ascii=False)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def word_path(self, key):
+        return os.path.join(self.words_dir, key + '.json.gz')
+
+    def get(self, key):
+        path = self.word_path(key)
+        if not os.path.exists(path):
+            return None
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            return expand_result(json.load(f))
+
+    def put(self, key, result):
+        path = self.word_path(key)
+        # 先写临时文件再改名，避免进程被杀时留下不完整的缓存
+        with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+            json.dump(compact_result(result), f, ensure_ascii=False, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    def manifest_path(self, name):
+        return os.path.join(self.manifest_dir, name + '.json')
+
+    def save_manifest(self, name, audio_hash, regions, speech_spans=None):
+        """regions: [(own_start, own_end, decode_start, key), ...]，含义同transcriber.stitch_words
+
+        speech_spans: 转文本前去掉了静音时，保留的语音区间。此时regions中是压缩后音频的位置
+        """
+        with open(self.manifest_path(name), 'w', encoding='utf-8') as f:
+            json.dump({'audio_hash': audio_hash, 'regions': regions, 'speech_spans': speech_spans}, f)
+
+    def load_speech_spans(self, name):
+        path = self.manifest_path(name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('speech_spans')
+
+    def load_regions(self, name):
+        """读取文件清单，返回可以直接交给stitch_words的区域列表。缓存不完整时返回None"""
+        path = self.manifest_path(name)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        regions = []
+        for own_start, own_end, decode_start, key in manifest['regions']:
+            result = self.get(key)
+            if result is None:
+                LOGGER.warn(f'{name} 的缓存不完整')
+                return None
+            regions.append((own_start, own_end, decode_start, result))
+        return regions